@@ -99,7 +99,7 @@ class Plugin(PluginBase):
 
     def on_open(self):
         """Actions to be performed after a project is opened."""
-        self.snapshotService.refresh()
+        self.snapshotService.on_open()
 
     def on_quit(self):
         """Actions to be performed before the application is closed."""
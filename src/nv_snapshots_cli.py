@@ -0,0 +1,503 @@
+"""A command line interface for the nv_snapshots snapshot archives.
+
+Create, list, summarize, compare, verify, prune, export, and restore snapshots
+of novelibre projects without a display, e.g. from cron jobs.
+The archives are the same as those created by the plugin.
+
+usage: nv_snapshots_cli.py [-h] COMMAND [options] PROJECT [PROJECT ...]
+
+Several projects are processed in parallel.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import configparser
+from itertools import repeat
+import os
+import sys
+
+from nvsnapshots.nvsnapshots_locale import _
+from nvsnapshots.nvsnapshots_settings import OPTIONS
+from nvsnapshots.nvsnapshots_settings import SETTINGS
+from nvsnapshots.nvsnapshots_settings import get_ini_path
+from nvsnapshots.snapshot_archive import SnapshotArchive
+from nvsnapshots.snapshot_archive import verify_archives
+from nvsnapshots.snapshot_catalog import SnapshotCatalog
+from nvsnapshots.snapshot_compression import format_benchmark
+from nvsnapshots.snapshot_compression import run_benchmark
+from nvsnapshots.snapshot_diff import compare_snapshots
+from nvsnapshots.snapshot_retention import RetentionPolicy
+
+NOVX_EXTENSION = '.novx'
+
+
+def benchmark_compression(prjPath, args, settings):
+    """Show throughput and ratio of the compression settings."""
+    return format_benchmark(run_benchmark(prjPath))
+
+
+def compare_snapshot(prjPath, args, settings):
+    """List the differences between two snapshots section by section.
+
+    By default, the latest snapshot is compared with the one before.
+    """
+    catalog = _get_catalog(prjPath, settings)
+    snapshots = catalog.update()
+    newId = _get_snapshot_id(catalog, args.new)
+    oldId = args.old
+    if oldId is None:
+        olderIds = [
+            snapshotId for snapshotId in snapshots
+            if snapshotId < newId
+        ]
+        if not olderIds:
+            raise FileNotFoundError(_('Snapshot not found'))
+
+        oldId = max(olderIds)
+    oldId = _get_snapshot_id(catalog, oldId)
+    oldDigest = catalog.get_chapter_digest(oldId)
+    newDigest = catalog.get_chapter_digest(newId)
+    if oldDigest is not None and oldDigest == newDigest:
+        # The catalog shows that no chapter or section has changed.
+        return [f'--- {oldId}', f'+++ {newId}']
+
+    lines = compare_snapshots(
+        SnapshotArchive(catalog.get_path(oldId)),
+        SnapshotArchive(catalog.get_path(newId)),
+        oldTable=catalog.get_chapter_table(oldId),
+        newTable=catalog.get_chapter_table(newId),
+    )
+    return [f'--- {oldId}', f'+++ {newId}'] + lines
+
+
+def create_snapshot(prjPath, args, settings):
+    """Create a snapshot of the project, if there is none yet."""
+    if args.title is None:
+        return _write_snapshot(
+            prjPath,
+            settings,
+            _('Auto-generated snapshot'),
+            args.comment,
+            isAuto=True,
+        )
+
+    return _write_snapshot(
+        prjPath,
+        settings,
+        args.title,
+        args.comment,
+    )
+
+
+def export_snapshot(prjPath, args, settings):
+    """Write a self-contained snapshot archive."""
+    catalog = _get_catalog(prjPath, settings)
+    snapshotId = _get_snapshot_id(catalog, args.id)
+    targetDir = args.output
+    if targetDir is None:
+        targetDir = os.path.dirname(prjPath)
+    targetPath = os.path.join(
+        targetDir,
+        f'{snapshotId}{SnapshotCatalog.ZIP_EXTENSION}'
+    )
+    SnapshotArchive(catalog.get_path(snapshotId)).export_zip(targetPath)
+    return [f'{_("Snapshot exported")}: "{os.path.normpath(targetPath)}"']
+
+
+def list_snapshots(prjPath, args, settings):
+    """List the project's snapshots."""
+    snapshots = _get_catalog(prjPath, settings).update()
+    lines = []
+    for snapshotId, metadata in snapshots.items():
+        lines.append(
+            f'{snapshotId}\t'
+            f'{metadata.get("words used", "")}/'
+            f'{metadata.get("words total", "")}\t'
+            f'{metadata.get("title", "")}'
+        )
+    return lines
+
+
+def prune_snapshots(prjPath, args, settings):
+    """Delete old snapshots.
+
+    Keep the given number of latest snapshots, if any.
+    Otherwise, apply the plugin's retention rules.
+    """
+    catalog = _get_catalog(prjPath, settings)
+    snapshots = catalog.update()
+    if args.keep is None:
+        snapshotIds = RetentionPolicy(
+            keepAllHours=float(settings['keep_all_hours']),
+            keepDailyDays=float(settings['keep_daily_days']),
+            keepWeeklyWeeks=float(settings['keep_weekly_weeks']),
+            keepTitled=settings['keep_titled'],
+        ).get_obsolete(snapshots)
+    else:
+        snapshotIds = sorted(snapshots)
+        snapshotIds = snapshotIds[:max(len(snapshotIds) - args.keep, 0)]
+    if not args.dry_run:
+        catalog.remove(snapshotIds)
+    return [f'{_("Removed")}: {snapshotId}' for snapshotId in snapshotIds]
+
+
+def restore_snapshot(prjPath, args, settings):
+    """Overwrite the project file with a snapshot's project file.
+
+    The current project file is saved as a snapshot first.
+    Nothing is done, if the project file already matches the snapshot.
+    """
+    catalog = _get_catalog(prjPath, settings)
+    snapshotId = _get_snapshot_id(catalog, args.id)
+    metadata = catalog.update()[snapshotId]
+    archive = SnapshotArchive(catalog.get_path(snapshotId))
+    if archive.matches(prjPath, metadata):
+        return [
+            f'{_("The project already matches the snapshot")}: '
+            f'"{snapshotId}"'
+        ]
+
+    title = metadata.get('title', '')
+    lines = _write_snapshot(
+        prjPath,
+        settings,
+        _('Auto-generated snapshot'),
+        _('Before reverting to {} \n"{}"').format(snapshotId, title),
+        isAuto=True,
+    )
+    archive.extract_project(prjPath)
+    lines.append(f'{_("Snapshot restored")}: "{snapshotId}"')
+    return lines
+
+
+def summarize_snapshot(prjPath, args, settings):
+    """List the chapters and sections of a snapshot with word counts."""
+    catalog = _get_catalog(prjPath, settings)
+    snapshotId = _get_snapshot_id(catalog, args.id)
+    summary = SnapshotArchive(catalog.get_path(snapshotId)).scan_project()
+    lines = [
+        f'{snapshotId}\t'
+        f'{summary.wordsUsed}/{summary.wordsTotal}\t'
+        f'{summary.workPhase or ""}'
+    ]
+    for chapter in summary.chapters:
+        lines.append(f'{chapter.id}\t{chapter.words}\t{chapter.title}')
+        if args.sections:
+            for section in chapter.sections:
+                lines.append(
+                    f'  {section.id}\t{section.words}\t{section.title}'
+                )
+    return lines
+
+
+def verify_snapshots(prjPath, args, settings):
+    """Check the project's snapshot archives.
+
+    Archives verified before and not changed since are skipped.
+    With a single project, the archives are checked in parallel.
+    Raise RuntimeError, if problems are found.
+    """
+    catalog = _get_catalog(prjPath, settings)
+    unverified = catalog.get_unverified()
+    snapshotFiles = {
+        os.path.join(catalog.snapshotDir, snapshotFile): snapshotFile
+        for snapshotFile in unverified
+    }
+    maxWorkers = args.jobs
+    if len(args.projects) > 1:
+        # The projects are already processed in parallel.
+        maxWorkers = 1
+    results = verify_archives(list(snapshotFiles), maxWorkers=maxWorkers)
+    catalog.set_verified(
+        unverified,
+        {
+            snapshotFiles[filePath]: problems
+            for filePath, problems in results.items()
+        },
+    )
+    problems = catalog.get_problems()
+    lines = []
+    for snapshotFile in sorted(catalog.entries):
+        if snapshotFile in problems:
+            lines.append(
+                f'{snapshotFile}: {"; ".join(problems[snapshotFile])}'
+            )
+        else:
+            lines.append(f'{snapshotFile}: OK')
+    if problems:
+        raise RuntimeError('\n'.join(lines))
+
+    return lines
+
+
+COMMANDS = dict(
+    benchmark=benchmark_compression,
+    compare=compare_snapshot,
+    create=create_snapshot,
+    export=export_snapshot,
+    list=list_snapshots,
+    prune=prune_snapshots,
+    restore=restore_snapshot,
+    summary=summarize_snapshot,
+    verify=verify_snapshots,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Manage novelibre project snapshots.',
+    )
+    parser.add_argument(
+        '--subdir',
+        help='Snapshot folder name, relative to the project folder.',
+    )
+    parser.add_argument(
+        '--jobs',
+        type=int,
+        help=(
+            'Maximum number of parallel processes: '
+            'projects, or with "verify" and a single project, '
+            'archives checked.'
+        ),
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    createParser = subparsers.add_parser('create', help='Create snapshots.')
+    createParser.add_argument(
+        '--title',
+        help='Snapshot title; default: an auto-generated snapshot.',
+    )
+    createParser.add_argument('--comment', default='')
+    createParser.add_argument(
+        '--storage',
+        choices=SnapshotArchive.STORAGE_MODES,
+        help='Storage mode; default: as configured for the plugin.',
+    )
+    createParser.add_argument(
+        '--compression',
+        help=(
+            'stored, deflate:1..9, bzip2:1..9, or lzma; '
+            'default: as configured for automatic snapshots.'
+        ),
+    )
+
+    subparsers.add_parser('list', help='List snapshots.')
+
+    subparsers.add_parser(
+        'benchmark',
+        help='Compare the compression settings on the project files.',
+    )
+
+    subparsers.add_parser('verify', help='Check the snapshot archives.')
+
+    pruneParser = subparsers.add_parser(
+        'prune',
+        help='Delete old snapshots.',
+    )
+    pruneParser.add_argument(
+        '--keep',
+        type=int,
+        help=(
+            'Number of latest snapshots to keep; '
+            'default: apply the configured retention rules.'
+        ),
+    )
+    pruneParser.add_argument(
+        '--dry-run',
+        action='store_true',
+        help='List the snapshots to delete without deleting them.',
+    )
+
+    exportParser = subparsers.add_parser(
+        'export',
+        help='Write self-contained snapshot archives.',
+    )
+    exportParser.add_argument(
+        '--id',
+        help='Snapshot ID; default: the latest snapshot.',
+    )
+    exportParser.add_argument(
+        '--output',
+        help='Target folder; default: the project folder.',
+    )
+
+    restoreParser = subparsers.add_parser(
+        'restore',
+        help='Overwrite the project file with a snapshot.',
+    )
+    restoreParser.add_argument('--id', required=True)
+
+    compareParser = subparsers.add_parser(
+        'compare',
+        help='List the differences between two snapshots.',
+    )
+    compareParser.add_argument(
+        '--old',
+        help='Older snapshot ID; default: the one before the newer.',
+    )
+    compareParser.add_argument(
+        '--new',
+        help='Newer snapshot ID; default: the latest snapshot.',
+    )
+
+    summaryParser = subparsers.add_parser(
+        'summary',
+        help='List the chapters of a snapshot with word counts.',
+    )
+    summaryParser.add_argument(
+        '--id',
+        help='Snapshot ID; default: the latest snapshot.',
+    )
+    summaryParser.add_argument(
+        '--sections',
+        action='store_true',
+        help='List the sections, too.',
+    )
+
+    for subparser in subparsers.choices.values():
+        subparser.add_argument('projects', nargs='+', metavar='PROJECT')
+    args = parser.parse_args()
+    if (getattr(args, 'keep', None) or 0) < 0:
+        parser.error('--keep must not be negative')
+
+    settings = _read_settings()
+    if args.subdir is not None:
+        settings['snapshot_subdir'] = args.subdir
+    if getattr(args, 'storage', None) is not None:
+        settings['storage_mode'] = args.storage
+    if getattr(args, 'compression', None) is not None:
+        settings['compression_auto'] = args.compression
+
+    prjPaths = list(dict.fromkeys(
+        os.path.abspath(prjPath) for prjPath in args.projects
+    ))
+    if len(prjPaths) == 1:
+        results = [_run(prjPaths[0], args, settings)]
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            results = list(executor.map(
+                _run,
+                prjPaths,
+                repeat(args),
+                repeat(settings),
+            ))
+
+    exitCode = 0
+    for prjPath, isOk, lines in results:
+        prjFile = os.path.basename(prjPath)
+        stream = sys.stdout if isOk else sys.stderr
+        for line in lines:
+            print(f'{prjFile}: {line}', file=stream)
+        if not isOk:
+            exitCode = 1
+    return exitCode
+
+
+def _get_catalog(prjPath, settings):
+    # Return the snapshot catalog of a project.
+    projectDir, projectFile = os.path.split(prjPath)
+    prjName, __ = os.path.splitext(projectFile)
+    return SnapshotCatalog(
+        os.path.join(projectDir, settings['snapshot_subdir']),
+        prjName,
+    )
+
+
+def _get_snapshot_id(catalog, snapshotId):
+    # Return the snapshot ID, or the latest ID, if None.
+    # Raise FileNotFoundError, if there is no such snapshot.
+    snapshots = catalog.update()
+    if snapshotId is None and snapshots:
+        return max(snapshots)
+
+    if snapshotId not in snapshots:
+        raise FileNotFoundError(_('Snapshot not found'))
+
+    return snapshotId
+
+
+def _read_settings():
+    # Return the plugin settings and options from the configuration file.
+    settings = SETTINGS | OPTIONS
+    config = configparser.ConfigParser()
+    config.read(get_ini_path(), encoding='utf-8')
+    if config.has_section('SETTINGS'):
+        for keyword in settings:
+            if config.has_option('SETTINGS', keyword):
+                settings[keyword] = config.get('SETTINGS', keyword)
+    if config.has_section('OPTIONS'):
+        for keyword in OPTIONS:
+            if config.has_option('OPTIONS', keyword):
+                settings[keyword] = config.getboolean('OPTIONS', keyword)
+    return settings
+
+
+def _run(prjPath, args, settings):
+    # Run the command for a project.
+    # Return the project path, a success flag, and the output lines.
+    try:
+        if not os.path.isfile(prjPath):
+            raise FileNotFoundError(_('File not found'))
+
+        if os.path.splitext(prjPath)[1] != NOVX_EXTENSION:
+            raise ValueError(_('File type is not supported'))
+
+        return prjPath, True, COMMANDS[args.command](prjPath, args, settings)
+
+    except Exception as ex:
+        return prjPath, False, [f'{_("Error")}: {str(ex)}']
+
+
+def _write_snapshot(prjPath, settings, title, comment, isAuto=False):
+    # Create a snapshot of the project file, if there is none yet.
+    # Auto-generated snapshots are flagged for the retention rules.
+    # Return the output lines.
+    catalog = _get_catalog(prjPath, settings)
+    os.makedirs(catalog.snapshotDir, exist_ok=True)
+    snapshotId, isoDate = catalog.new_snapshot(prjPath)
+    if os.path.isfile(catalog.get_path(snapshotId)):
+        return [f'{_("Snapshot already exists")}: "{snapshotId}".']
+
+    identicalId = catalog.find_identical(prjPath)
+    if identicalId is not None:
+        return [f'{_("Snapshot already exists")}: "{identicalId}".']
+
+    metadata = {
+        'title': title,
+        'description': comment,
+        'date': isoDate,
+    }
+    if isAuto:
+        metadata['auto'] = True
+    storageMode = settings['storage_mode']
+    if storageMode not in SnapshotArchive.STORAGE_MODES:
+        storageMode = 'zip'
+    basePath = None
+    if storageMode == 'delta':
+        basePath = catalog.get_delta_base(int(settings['keyframe_interval']))
+    SnapshotArchive(catalog.get_path(snapshotId)).write(
+        prjPath,
+        snapshotId,
+        metadata,
+        storageMode=storageMode,
+        base=basePath,
+        compression=settings['compression_auto'],
+    )
+    return [f'{_("Snapshot generated")} ({isoDate})']
+
+
+if __name__ == '__main__':
+    sys.exit(main())
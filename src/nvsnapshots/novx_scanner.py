@@ -0,0 +1,403 @@
+"""Provide classes for streaming novx file analysis.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+import hashlib
+import re
+import xml.etree.ElementTree as ET
+
+ADDITIONAL_WORD_LIMITS = re.compile(r'--|—|–')
+SKIPPED_ELEMENTS = ('note', 'comment')
+
+
+class SectionSummary:
+    """Summary of a section."""
+    __slots__ = ('id', 'title', 'type', 'words', 'contentHash')
+
+    def __init__(self, scId, title, scType, content):
+        """Summarize a section.
+
+        Positional arguments:
+            scId: str -- Section ID.
+            title: str -- Section title.
+            scType: str -- Section type.
+            content -- Content element, or None.
+        """
+        self.id = scId
+        self.title = title
+        self.type = scType
+        if content is None:
+            self.words = 0
+            self.contentHash = get_hash('')
+        else:
+            self.words = len(get_text(content).split())
+            self.contentHash = get_content_hash(content)
+
+
+class ChapterSummary:
+    """Summary of a chapter with its sections."""
+    __slots__ = ('id', 'title', 'type', 'level', 'isTrash', 'sections')
+
+    def __init__(self, chId, chType, level, isTrash):
+        self.id = chId
+        self.title = ''
+        self.type = chType
+        self.level = level
+        self.isTrash = isTrash
+        self.sections = []
+
+    @property
+    def words(self):
+        """Return the number of words used in the chapter.
+
+        As with the project's "words used", only normal sections
+        in normal chapters count, so the chapters add up
+        to the project's figure.
+        """
+        if self.isTrash or self.type != '0':
+            return 0
+
+        return sum(
+            section.words for section in self.sections
+            if section.type == '0'
+        )
+
+
+class ProjectSummary:
+    """Summary of a project with its chapters.
+
+    elements is a dictionary with the CHAPTER and SECTION elements
+    requested when scanning. Chapter elements have no sections.
+    """
+    __slots__ = (
+        'workPhase',
+        'wordsUsed',
+        'wordsTotal',
+        'chapters',
+        'elements',
+    )
+
+    def __init__(self, statistics, chapters, elements):
+        self.workPhase = statistics['work phase']
+        self.wordsUsed = statistics['words used']
+        self.wordsTotal = statistics['words total']
+        self.chapters = chapters
+        self.elements = elements
+
+
+class NovxScanner:
+    """Collect project statistics and a chapter summary from novx XML data.
+
+    The scanner does not build a novel model. It can be fed chunk
+    by chunk, e.g. as a TeeReader consumer while archiving,
+    or read a file with iterparse.
+    Chapters, sections, and other entries are discarded after
+    processing, so memory use does not grow with the file size.
+    Words are counted like novelibre does: Normal sections
+    in normal chapters are "used"; unused sections and sections
+    in unused chapters are added to the total.
+    """
+
+    @classmethod
+    def scan(cls, f, keepIds=None):
+        """Return a ProjectSummary of a novx file.
+
+        Positional arguments:
+            f -- Binary file object with novx XML data.
+
+        Optional arguments:
+            keepIds -- Set of the IDs of the chapters and sections
+                       whose elements are kept for the summary.
+
+        Raise xml.etree.ElementTree.ParseError,
+        if the data is not well-formed.
+        """
+        scanner = cls(keepIds)
+        for event, element in ET.iterparse(f, events=('start', 'end')):
+            scanner._handle(event, element)
+        return ProjectSummary(
+            scanner.statistics,
+            scanner.chapters,
+            scanner.elements,
+        )
+
+    def __init__(self, keepIds=None):
+        """Initialize the statistics.
+
+        Optional arguments:
+            keepIds -- Set of the IDs of the chapters and sections
+                       whose elements are kept in the elements
+                       dictionary.
+        """
+        self.statistics = {
+            'work phase': None,
+            'words used': 0,
+            'words total': 0,
+        }
+        self.chapters = []
+        self.elements = {}
+        self._keepIds = keepIds or ()
+        self._parser = None
+        self._openElements = []
+        self._isValid = True
+
+    def close(self):
+        """Finish parsing the data fed and return the statistics.
+
+        The statistics include the chapter table,
+        see get_chapter_table().
+        Return an empty dictionary, if the data is not well-formed.
+        """
+        if self._isValid and self._parser is not None:
+            try:
+                self._parser.close()
+                self._process_events()
+            except ET.ParseError:
+                self._isValid = False
+        if not self._isValid:
+            return {}
+
+        return self.statistics | {
+            'chapters': get_chapter_table(self.chapters),
+        }
+
+    def update(self, data):
+        """Parse a chunk of novx XML data.
+
+        Positional arguments:
+            data: bytes -- The next chunk.
+        """
+        if not self._isValid:
+            return
+
+        if self._parser is None:
+            self._parser = ET.XMLPullParser(events=('start', 'end'))
+        try:
+            self._parser.feed(data)
+            self._process_events()
+        except ET.ParseError:
+            self._isValid = False
+
+    def _add_section(self, section):
+        # Summarize a section and add its words to the totals.
+        if self.chapters:
+            chapter = self.chapters[-1]
+        else:
+            chapter = ChapterSummary(None, '0', '2', False)
+            self.chapters.append(chapter)
+        sectionType = section.get('type', '0')
+        summary = SectionSummary(
+            section.get('id', None),
+            section.findtext('Title', ''),
+            sectionType,
+            section.find('Content'),
+        )
+        chapter.sections.append(summary)
+        words = summary.words
+        if chapter.isTrash or sectionType not in ('0', '1'):
+            # Trash or stage.
+            return
+
+        self.statistics['words total'] += words
+        if sectionType == '0' and chapter.type == '0':
+            self.statistics['words used'] += words
+
+    def _handle(self, event, element):
+        # Process a parser event.
+        if event == 'start':
+            self._openElements.append(element)
+            if element.tag == 'PROJECT':
+                self._set_work_phase(element)
+            elif element.tag == 'CHAPTER':
+                self.chapters.append(
+                    ChapterSummary(
+                        element.get('id', None),
+                        element.get('type', '0'),
+                        element.get('level', '2'),
+                        element.get('isTrash', '0') == '1',
+                    )
+                )
+            return
+
+        self._openElements.pop()
+        if element.tag == 'SECTION':
+            self._add_section(element)
+        elif element.tag == 'CHAPTER':
+            self.chapters[-1].title = element.findtext('Title', '')
+        if element.tag in ('SECTION', 'CHAPTER'):
+            elementId = element.get('id', None)
+            if elementId in self._keepIds:
+                self.elements[elementId] = element
+        if element.tag != 'SECTION' and len(self._openElements) != 2:
+            return
+
+        # Discard the processed element.
+        # Sections, chapters, and the entries of the other
+        # top level lists are removed from their parents.
+        self._openElements[-1].remove(element)
+
+    def _process_events(self):
+        # Process the parser events of the data fed so far.
+        for event, element in self._parser.read_events():
+            self._handle(event, element)
+
+    def _set_work_phase(self, element):
+        # Read the work phase from the project's start tag.
+        workPhase = element.get('workPhase', None)
+        if workPhase is not None:
+            try:
+                self.statistics['work phase'] = int(workPhase)
+            except ValueError:
+                pass
+
+
+def get_chapter_digest(table):
+    """Return a compact digest of a chapter table for the catalog.
+
+    Positional arguments:
+        table: list -- Chapter table, see get_chapter_table().
+
+    Each chapter is a list [ID, title hash, words used, sections hash].
+    The sections hash changes whenever a section of the chapter
+    is added, removed, moved, renamed, or edited.
+    """
+    digest = []
+    for chId, chTitleHash, chWords, chSections in table:
+        digest.append([
+            chId,
+            chTitleHash,
+            chWords,
+            get_hash(
+                ';'.join(
+                    f'{scId},{scTitleHash},{scWords},{contentHash}'
+                    for scId, scTitleHash, scWords, contentHash in chSections
+                )
+            ),
+        ])
+    return digest
+
+
+def get_chapter_table(chapters):
+    """Return a compact chapter table for the snapshot metadata.
+
+    Positional arguments:
+        chapters -- List of ChapterSummary.
+
+    Each chapter is a list [ID, title hash, words used, sections],
+    each section a list [ID, title hash, words, content hash].
+    """
+    table = []
+    for chapter in chapters:
+        sections = []
+        for section in chapter.sections:
+            sections.append([
+                section.id,
+                get_hash(section.title),
+                section.words,
+                section.contentHash,
+            ])
+        table.append([
+            chapter.id,
+            get_hash(chapter.title),
+            chapter.words,
+            sections,
+        ])
+    return table
+
+
+def get_content_hash(element):
+    """Return a short hash of a content element's XML.
+
+    Only the content is hashed, not the element's own tag and tail,
+    so an element read from a project file and an element parsed
+    from the novel model's section content get the same hash.
+    """
+    parts = [element.text or '']
+    for child in element:
+        parts.append(ET.tostring(child, encoding='unicode'))
+    return get_hash(''.join(parts))
+
+
+def get_hash(text):
+    """Return a short hash of a text for change detection."""
+    return hashlib.sha1((text or '').encode('utf-8')).hexdigest()[:16]
+
+
+def get_section_summary(scId, title, scType, content):
+    """Return a SectionSummary of a section in the novel model.
+
+    Positional arguments:
+        scId: str -- Section ID.
+        title: str -- Section title.
+        scType: int -- Section type.
+        content: str -- Section content as stored in the novel model.
+    """
+    try:
+        element = ET.fromstring(f'<Content>{content or ""}</Content>')
+    except ET.ParseError:
+        element = ET.Element('Content')
+        element.text = content
+    return SectionSummary(scId, title or '', str(scType), element)
+
+
+def get_paragraphs(element):
+    """Return a list with the paragraph texts of a content element.
+
+    Notes and comments are skipped; whitespace is normalized.
+    """
+    paragraphs = []
+    for child in element:
+        if child.tag in SKIPPED_ELEMENTS:
+            continue
+
+        parts = []
+        _collect_text(child, parts)
+        paragraphs.append(' '.join(''.join(parts).split()))
+    return paragraphs
+
+
+def get_text(element):
+    """Return the text of a content element for word counting.
+
+    Notes and comments are skipped; paragraph ends and dashes
+    separate words.
+    """
+    parts = []
+    _collect_text(element, parts)
+    return ADDITIONAL_WORD_LIMITS.sub(' ', ''.join(parts))
+
+
+def get_word_count(content):
+    """Return the number of words of a section's XML content.
+
+    Positional arguments:
+        content: str -- Section content as stored in the novel model.
+    """
+    if not content:
+        return 0
+
+    try:
+        element = ET.fromstring(f'<Content>{content}</Content>')
+    except ET.ParseError:
+        return len(ADDITIONAL_WORD_LIMITS.sub(
+            ' ',
+            re.sub('<[^>]*>', ' ', content),
+        ).split())
+
+    return len(get_text(element).split())
+
+
+def _collect_text(parent, parts):
+    # Append the text of an element and its children to a list,
+    # skipping notes and comments.
+    if parent.text:
+        parts.append(parent.text)
+    for child in parent:
+        if child.tag not in SKIPPED_ELEMENTS:
+            _collect_text(child, parts)
+            if child.tag == 'p':
+                parts.append(' ')
+        if child.tail:
+            parts.append(child.tail)
@@ -29,6 +29,18 @@ class NvsnapshotsMenu(tk.Menu):
             label=_('Clean up Snapshot folder'),
             command=self._event('<<clean_up>>'),
         )
+        self._fileMenu.add_command(
+            label=_('Verify snapshots'),
+            command=self._event('<<verify_snapshots>>'),
+        )
+        self._fileMenu.add_command(
+            label=_('Delete old snapshots'),
+            command=self._event('<<prune>>'),
+        )
+        self._fileMenu.add_command(
+            label=_('Compression benchmark'),
+            command=self._event('<<benchmark>>'),
+        )
         self._fileMenu.add_separator()
         self._fileMenu.add_command(
             label=_('Snapshot'),
@@ -43,10 +55,18 @@ class NvsnapshotsMenu(tk.Menu):
             accelerator=KEYS.DELETE[1],
             command=self._event('<<remove_snapshot>>'),
         )
+        self._fileMenu.add_command(
+            label=_('Compare'),
+            command=self._event('<<compare_snapshots>>'),
+        )
         self._fileMenu.add_command(
             label=_('Revert'),
             command=self._event('<<revert>>'),
         )
+        self._fileMenu.add_command(
+            label=_('Restore chapters or sections'),
+            command=self._event('<<restore_parts>>'),
+        )
         self._fileMenu.add_separator()
         self._fileMenu.add_command(
             label=_('Close'),
@@ -60,6 +80,11 @@ class NvsnapshotsMenu(tk.Menu):
             label=_('Export'),
             menu=self._exportMenu,
         )
+        self._exportMenu.add_command(
+            label=_('All documents'),
+            command=self._event('<<export_all>>'),
+        )
+        self._exportMenu.add_separator()
         self._exportMenu.add_command(
             label=_('Manuscript'),
             command=self._event('<<export_manuscript>>'),
@@ -108,6 +133,11 @@ class NvsnapshotsMenu(tk.Menu):
             label=_('XML data files'),
             command=self._event('<<export_data>>'),
         )
+        self._exportMenu.add_separator()
+        self._exportMenu.add_command(
+            label=_('Self-contained ZIP archive'),
+            command=self._event('<<export_zip>>'),
+        )
 
         # Help menu.
         self._helpMenu = tk.Menu(self, tearoff=0)
@@ -0,0 +1,48 @@
+"""Provide the configuration defaults shared by the plugin and the CLI.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+from pathlib import Path
+
+INI_FILENAME = 'snapshots.ini'
+INI_FILEPATH = '.novx/config'
+SETTINGS = dict(
+    snapshot_subdir='Snapshots',
+    storage_mode='zip',
+    keyframe_interval=10,
+    compression_manual='deflate:9',
+    compression_auto='deflate:1',
+    window_geometry='1270x250',
+    right_frame_width=350,
+    id_width=160,
+    title_width=240,
+    date_width=120,
+    words_used_width=55,
+    words_total_width=100,
+    work_phase_width=140,
+    group_threshold=500,
+    keep_all_hours=48,
+    keep_daily_days=30,
+    keep_weekly_weeks=0,
+    auto_snapshot_interval=0,
+    auto_snapshot_saves=0,
+    auto_snapshot_idle=30,
+    auto_snapshot_threshold=100,
+)
+OPTIONS = dict(
+    auto_prune=False,
+    keep_titled=True,
+    auto_snapshot_on_save=False,
+)
+
+
+def get_ini_path():
+    """Return the path of the configuration file."""
+    try:
+        homeDir = str(Path.home()).replace('\\', '/')
+        configDir = f'{homeDir}/{INI_FILEPATH}'
+    except:
+        configDir = '.'
+    return f'{configDir}/{INI_FILENAME}'
@@ -0,0 +1,126 @@
+"""Provide a class for a dialog selecting chapters and sections to restore.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+from tkinter import ttk
+
+from nvlib.gui.widgets.modal_dialog import ModalDialog
+from nvsnapshots.nvsnapshots_help import Nvsnapshotshelp
+from nvsnapshots.nvsnapshots_locale import _
+from nvsnapshots.platform.platform_settings import KEYS
+
+
+class PartialRestoreDialog(ModalDialog):
+    """List the chapters and sections of a snapshot for selection.
+
+    A selected chapter stands for the chapter with all its sections.
+    """
+
+    def __init__(self, view, summary, command, **kw):
+        """Show the snapshot's chapters and sections.
+
+        Positional arguments:
+            view -- The application's main view.
+            summary: ProjectSummary -- The snapshot's project summary.
+            command -- Callback function taking a set
+                       with the IDs of the selected chapters and sections.
+        """
+        super().__init__(view, **kw)
+        self._command = command
+        self._chapterSections = {}
+        # key: chapter ID, value: list of section IDs
+
+        self.title(_('Restore chapters or sections'))
+        mainWindow = ttk.Frame(self)
+        mainWindow.pack(
+            fill='both',
+            expand=True,
+            padx=5,
+            pady=5
+        )
+        treeFrame = ttk.Frame(mainWindow)
+        treeFrame.pack(fill='both', expand=True)
+        self._treeView = ttk.Treeview(
+            treeFrame,
+            columns=('words',),
+            selectmode='extended',
+            height=20,
+        )
+        scrollY = ttk.Scrollbar(
+            treeFrame,
+            orient='vertical',
+            command=self._treeView.yview,
+        )
+        self._treeView.configure(yscrollcommand=scrollY.set)
+        scrollY.pack(side='right', fill='y')
+        self._treeView.pack(side='left', fill='both', expand=True)
+        self._treeView.heading('#0', text=_('Title'))
+        self._treeView.heading('words', text=_('Words'))
+        self._treeView.column('#0', width=300)
+        self._treeView.column('words', width=80, anchor='e')
+
+        for chapter in summary.chapters:
+            if chapter.id is None:
+                continue
+
+            self._treeView.insert(
+                '',
+                'end',
+                chapter.id,
+                text=chapter.title or chapter.id,
+                values=(chapter.words,),
+            )
+            self._chapterSections[chapter.id] = []
+            for section in chapter.sections:
+                if section.id is None:
+                    continue
+
+                self._treeView.insert(
+                    chapter.id,
+                    'end',
+                    section.id,
+                    text=section.title or section.id,
+                    values=(section.words,),
+                )
+                self._chapterSections[chapter.id].append(section.id)
+
+        buttons_frame = ttk.Frame(mainWindow)
+        buttons_frame.pack(fill='both')
+
+        # Button: Restore.
+        ttk.Button(
+            buttons_frame,
+            text=_('Restore'),
+            command=self._restore,
+        ).pack(padx=5, pady=5, side='left')
+
+        # Button: Cancel.
+        ttk.Button(
+            buttons_frame,
+            text=_('Cancel'),
+            command=self.destroy,
+        ).pack(padx=5, pady=5, side='right')
+
+        # "Help" button.
+        ttk.Button(
+            buttons_frame,
+            text=_('Online help'),
+            command=self._open_help
+        ).pack(padx=5, pady=5, side='right')
+
+        # Set Key bindings.
+        self.bind(KEYS.OPEN_HELP[0], self._open_help)
+
+    def _open_help(self, event=None):
+        Nvsnapshotshelp.open_help_page()
+
+    def _restore(self, event=None):
+        elementIds = set()
+        for nodeId in self._treeView.selection():
+            elementIds.add(nodeId)
+            elementIds.update(self._chapterSections.get(nodeId, []))
+        self.destroy()
+        if elementIds:
+            self._command(elementIds)
@@ -0,0 +1,86 @@
+"""Provide a class for measuring content changes between snapshots.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+import hashlib
+
+from nvsnapshots.novx_scanner import get_word_count
+
+
+class SectionChangeTracker:
+    """Estimate the number of words changed since the last snapshot.
+
+    For each section, the content string, its hash, and its word count
+    are cached. A content string that is the same object as the cached
+    one is not hashed again, so unchanged sections cost next to nothing.
+    Words are only counted for sections with a new hash.
+    """
+
+    def __init__(self):
+        self._snapshotState = {}
+        # key: section ID, value: (content, hash, word count)
+        # at the last snapshot
+        self._currentState = {}
+        # key: section ID, value: (content, hash, word count)
+        # at the last check
+
+    def get_changed_words(self, contents):
+        """Return the number of words added or removed since the snapshot.
+
+        Positional arguments:
+            contents: dict -- key: section ID, value: section content.
+
+        Sections whose content changed without changing the number
+        of words count as one word.
+        """
+        self._currentState = self._get_states(contents)
+        changedWords = 0
+        for scId, (__, digest, words) in self._currentState.items():
+            snapshotState = self._snapshotState.get(scId, None)
+            if snapshotState is None:
+                changedWords += words
+            elif digest != snapshotState[1]:
+                changedWords += max(abs(words - snapshotState[2]), 1)
+        for scId, (__, __, words) in self._snapshotState.items():
+            if scId not in self._currentState:
+                changedWords += words
+        return changedWords
+
+    def set_snapshot(self, contents):
+        """Remember the section contents of a snapshot.
+
+        Positional arguments:
+            contents: dict -- key: section ID, value: section content.
+        """
+        self._snapshotState = self._get_states(contents)
+        self._currentState = {}
+
+    def _get_states(self, contents):
+        # Return the states of the sections.
+        states = {}
+        for scId, content in contents.items():
+            states[scId] = self._get_state(scId, content)
+        return states
+
+    def _get_state(self, scId, content):
+        # Return the state of a section, using the cached ones
+        # where possible.
+        cachedStates = [
+            state for state in (
+                self._currentState.get(scId, None),
+                self._snapshotState.get(scId, None),
+            )
+            if state is not None
+        ]
+        for state in cachedStates:
+            if state[0] is content:
+                return state
+
+        digest = hashlib.sha1((content or '').encode('utf-8')).digest()
+        for state in cachedStates:
+            if state[1] == digest:
+                return (content, digest, state[2])
+
+        return (content, digest, get_word_count(content))
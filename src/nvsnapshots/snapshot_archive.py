@@ -0,0 +1,632 @@
+"""Provide a class for snapshot archive access.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+import zipfile
+
+from nvsnapshots.novx_scanner import NovxScanner
+from nvsnapshots.snapshot_compression import parse_compression
+from nvsnapshots.snapshot_delta import apply_delta
+from nvsnapshots.snapshot_delta import make_delta
+from nvsnapshots.snapshot_store import ChunkReader
+from nvsnapshots.snapshot_store import SnapshotStore
+from nvsnapshots.snapshot_store import TeeReader
+from nvsnapshots.snapshot_store import iter_novx_chunks
+
+
+class SnapshotArchive:
+    """Read and write snapshot ZIP archives.
+
+    A snapshot archive contains the project file,
+    a descriptive text file, and a JSON metadata file.
+    With the "dedup" storage mode, the project file is replaced
+    by a manifest that lists its chunks in the snapshot folder's
+    object store.
+    With the "delta" storage mode, the project file is replaced
+    by a binary delta against a base snapshot in the same folder.
+    This class does not depend on the GUI, so it can be used
+    in a background thread.
+    """
+    META_FILE = 'meta.json'
+    MANIFEST_FILE = 'manifest.json'
+    DELTA_FILE = 'delta.json'
+    DELTA_DATA_FILE = 'delta.bin'
+    DESC_EXTENSION = '.txt'
+    TEMP_EXTENSION = '.tmp'
+    COMPRESSED_EXTENSIONS = ('.novxz',)
+    CHUNK_SIZE = 1024 * 1024
+    STORAGE_MODES = ('zip', 'dedup', 'delta')
+
+    @classmethod
+    def hash_file(cls, filePath):
+        """Return the SHA-256 hex digest of a file's content."""
+        hasher = hashlib.sha256()
+        with open(filePath, 'rb') as f:
+            while True:
+                data = f.read(cls.CHUNK_SIZE)
+                if not data:
+                    return hasher.hexdigest()
+
+                hasher.update(data)
+
+    def __init__(self, filePath):
+        """Set the archive path.
+
+        Positional arguments:
+            filePath: str -- Path to the snapshot ZIP file.
+        """
+        self.filePath = filePath
+        self.store = SnapshotStore(os.path.dirname(filePath))
+
+    def export_zip(self, targetPath):
+        """Write a self-contained snapshot archive.
+
+        Positional arguments:
+            targetPath: str -- Path of the ZIP file to create.
+
+        The exported archive contains the full project file,
+        regardless of the storage mode.
+        """
+        with zipfile.ZipFile(self.filePath, 'r') as z:
+            referenceFile = self._get_reference_file(z)
+            if referenceFile is None:
+                shutil.copy2(self.filePath, targetPath)
+                return
+
+        metadata = self.read_metadata()
+        for snapshotId in metadata:
+            for key in ('storage', 'base', 'chain'):
+                metadata[snapshotId].pop(key, None)
+        with zipfile.ZipFile(self.filePath, 'r') as src:
+            with zipfile.ZipFile(targetPath, 'w') as dst:
+                prjFile = self._get_project_name(src)
+                with self.open_project() as prjSrc:
+                    zipInfo = zipfile.ZipInfo(
+                        prjFile,
+                        date_time=src.getinfo(referenceFile).date_time,
+                    )
+                    zipInfo.compress_type = zipfile.ZIP_DEFLATED
+                    with dst.open(zipInfo, 'w') as prjDst:
+                        shutil.copyfileobj(prjSrc, prjDst, self.CHUNK_SIZE)
+                for member in src.namelist():
+                    if member.endswith(self.DESC_EXTENSION):
+                        dst.writestr(
+                            member,
+                            src.read(member),
+                            compress_type=zipfile.ZIP_DEFLATED,
+                        )
+                dst.writestr(
+                    self.META_FILE,
+                    json.dumps(metadata),
+                    compress_type=zipfile.ZIP_DEFLATED,
+                )
+
+    def extract_project(self, targetPath):
+        """Write the archived project file.
+
+        Positional arguments:
+            targetPath: str -- Path of the project file to write.
+
+        The project file is written to a temporary file next to the
+        target, and checked against the ZIP CRC and the size and hash
+        stored in the metadata. Only then it replaces the target,
+        so the target is never left half-written.
+        Return False, if the target already matches the snapshot
+        and is left untouched; otherwise return True.
+        Raise ValueError, if the extracted file does not match.
+        """
+        metadata = self._get_metadata()
+        if self.matches(targetPath, metadata):
+            return False
+
+        tempPath = f'{targetPath}{self.TEMP_EXTENSION}'
+        hasher = hashlib.sha256()
+        size = 0
+        try:
+            # Reading a ZIP member to the end checks its CRC.
+            with self.open_project() as src:
+                with open(tempPath, 'wb') as dst:
+                    while True:
+                        data = src.read(self.CHUNK_SIZE)
+                        if not data:
+                            break
+
+                        hasher.update(data)
+                        size += len(data)
+                        dst.write(data)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+            problems = self._check_project(metadata, size, hasher)
+            if problems:
+                raise ValueError('; '.join(problems))
+
+            if os.path.isfile(targetPath):
+                shutil.copymode(targetPath, tempPath)
+            os.replace(tempPath, targetPath)
+        except:
+            try:
+                os.remove(tempPath)
+            except OSError:
+                pass
+            raise
+
+        return True
+
+    def get_chunk_keys(self):
+        """Return a list with the object keys of a deduplicated snapshot.
+
+        Return an empty list, if the project file is stored as a whole.
+        """
+        with zipfile.ZipFile(self.filePath, 'r') as z:
+            if self.MANIFEST_FILE not in z.namelist():
+                return []
+
+            return json.loads(z.read(self.MANIFEST_FILE))['chunks']
+
+    def get_base_id(self):
+        """Return the ID of the base snapshot of a delta snapshot.
+
+        Return None, if the snapshot does not depend on another snapshot.
+        """
+        with zipfile.ZipFile(self.filePath, 'r') as z:
+            if self.DELTA_FILE not in z.namelist():
+                return None
+
+            return json.loads(z.read(self.DELTA_FILE))['base']
+
+    def get_project_name(self):
+        """Return the file name of the archived project."""
+        with zipfile.ZipFile(self.filePath, 'r') as z:
+            return self._get_project_name(z)
+
+    @contextmanager
+    def open_project(self):
+        """Open the archived project file for binary reading.
+
+        Use as context manager.
+        """
+        with zipfile.ZipFile(self.filePath, 'r') as z:
+            if self.MANIFEST_FILE in z.namelist():
+                manifest = json.loads(z.read(self.MANIFEST_FILE))
+                chunks = (self.store.get(key) for key in manifest['chunks'])
+                with ChunkReader.open(chunks) as f:
+                    yield f
+                return
+
+            if self.DELTA_FILE in z.namelist():
+                with io.BytesIO(self.read_project()) as f:
+                    yield f
+                return
+
+            with z.open(self._get_project_name(z), 'r') as f:
+                yield f
+
+    def make_keyframe(self):
+        """Rewrite the archive with the full project file.
+
+        Use this before deleting a snapshot that other snapshots
+        are based on.
+        """
+        tempPath = f'{self.filePath}{self.TEMP_EXTENSION}'
+        self.export_zip(tempPath)
+        os.replace(tempPath, self.filePath)
+
+    def matches(self, filePath, metadata=None):
+        """Return True if a file is identical to the archived project file.
+
+        Positional arguments:
+            filePath: str -- Path to the file to compare.
+
+        Optional arguments:
+            metadata: dict -- The snapshot's metadata, e.g. from the
+                              catalog; default: read from the archive.
+
+        The file is compared with the size and hash stored
+        in the metadata, and hashed only if the sizes match.
+        Return False, if the file or the hash is missing.
+        """
+        if metadata is None:
+            metadata = self._get_metadata()
+        if 'sha256' not in metadata:
+            return False
+
+        try:
+            if os.path.getsize(filePath) != metadata.get('size', None):
+                return False
+
+            return self.hash_file(filePath) == metadata['sha256']
+
+        except OSError:
+            return False
+
+    def read_project(self):
+        """Return the content of the archived project file."""
+        with zipfile.ZipFile(self.filePath, 'r') as z:
+            if self.DELTA_FILE not in z.namelist():
+                with self.open_project() as f:
+                    return f.read()
+
+            delta = json.loads(z.read(self.DELTA_FILE))
+            literals = z.read(self.DELTA_DATA_FILE)
+        baseArchive = SnapshotArchive(
+            os.path.join(
+                os.path.dirname(self.filePath),
+                f'{delta["base"]}{os.path.splitext(self.filePath)[1]}'
+            )
+        )
+        return apply_delta(
+            baseArchive.read_project(),
+            delta['ops'],
+            literals,
+        )
+
+    def read_metadata(self):
+        """Return the content of the archive's JSON metadata file."""
+        with zipfile.ZipFile(self.filePath, 'r') as z:
+            with z.open(self.META_FILE, 'r') as f:
+                return json.loads(f.read())
+
+    def scan_project(self, keepIds=None):
+        """Return a ProjectSummary of the archived project file.
+
+        Optional arguments:
+            keepIds -- Set of the IDs of the chapters and sections
+                       whose elements are kept for the summary.
+
+        The project XML is streamed from the archive, and
+        no novel is built, so memory use stays small even for
+        huge projects.
+        Raise ValueError, if the archived project file is compressed.
+        Raise xml.etree.ElementTree.ParseError,
+        if the project XML is not well-formed.
+        """
+        if self.get_project_name().lower().endswith(
+            self.COMPRESSED_EXTENSIONS
+        ):
+            raise ValueError('Compressed project files cannot be scanned.')
+
+        with self.open_project() as f:
+            return NovxScanner.scan(f, keepIds)
+
+    def verify(self):
+        """Check the archive and return a list of the problems found.
+
+        - The CRCs of all members are checked.
+        - The metadata and the project file, or the member
+          replacing it, must be present.
+        - The project file is read in full and compared with the
+          size and hash stored in the metadata.
+        - Unless compressed, the project XML must be well-formed.
+        """
+        problems = []
+        try:
+            with zipfile.ZipFile(self.filePath, 'r') as z:
+                badMember = z.testzip()
+                if self.META_FILE not in z.namelist():
+                    problems.append('Metadata file is missing')
+                    return problems
+
+                prjFile = self._get_project_name(z)
+            if badMember is not None:
+                problems.append(f'Bad CRC: {badMember}')
+            metadata = self._get_metadata()
+            hasher = hashlib.sha256()
+            scanner = None
+            if not prjFile.lower().endswith(self.COMPRESSED_EXTENSIONS):
+                scanner = NovxScanner()
+            size = 0
+            with self.open_project() as f:
+                while True:
+                    data = f.read(self.CHUNK_SIZE)
+                    if not data:
+                        break
+
+                    hasher.update(data)
+                    if scanner is not None:
+                        scanner.update(data)
+                    size += len(data)
+        except Exception as ex:
+            problems.append(str(ex))
+            return problems
+
+        problems.extend(self._check_project(metadata, size, hasher))
+        if scanner is not None and not scanner.close():
+            problems.append('Project XML is not well-formed')
+        return problems
+
+    def write(
+            self,
+            prjPath,
+            snapshotId,
+            metadata,
+            progress=None,
+            storageMode='zip',
+            base=None,
+            compression='deflate',
+    ):
+        """Create the snapshot archive.
+
+        Positional arguments:
+            prjPath: str -- Path to the project file to be archived.
+            snapshotId: str -- Key of the metadata entry.
+            metadata: dict -- Snapshot metadata with title and description.
+
+        Optional arguments:
+            progress -- Callback function taking the number of bytes
+                        processed and the total number of bytes.
+            storageMode: str -- One of STORAGE_MODES.
+            base: str -- Path to the base snapshot archive for a delta.
+                         If None, a "delta" snapshot is a keyframe
+                         with the full project file.
+            compression: str -- Compression specification,
+                                e.g. "deflate:9".
+                                Project files that are already
+                                compressed are stored as they are.
+
+        The project file's size and SHA-256 hash are added
+        to the metadata. Unless the project file is compressed,
+        the work phase and the word counts are added as well.
+        The project file is read once, in chunks; compression,
+        hashing, and word counting are fed from the same buffer.
+        The archive is written under a temporary name and renamed
+        when complete, so an interrupted write never leaves
+        a truncated archive with the snapshot's name.
+        """
+        title = metadata['title']
+        comment = metadata['description']
+        metadata = metadata.copy()
+        hasher = hashlib.sha256()
+        consumers = [hasher]
+        scanner = None
+        if not prjPath.lower().endswith(self.COMPRESSED_EXTENSIONS):
+            scanner = NovxScanner()
+            consumers.append(scanner)
+        totalBytes = os.path.getsize(prjPath)
+        compressType, compressLevel = parse_compression(compression)
+        tempPath = f'{self.filePath}{self.TEMP_EXTENSION}'
+        try:
+            with open(tempPath, 'wb') as zipFile:
+                with zipfile.ZipFile(
+                    zipFile,
+                    'w',
+                    compression=compressType,
+                    compresslevel=compressLevel,
+                ) as z:
+
+                    # Write project file.
+                    with open(prjPath, 'rb') as prjFile:
+                        f = TeeReader(
+                            prjFile,
+                            consumers=consumers,
+                            progress=progress,
+                            totalBytes=totalBytes,
+                        )
+                        if storageMode == 'dedup':
+                            self._write_manifest(z, prjPath, f)
+                            metadata['storage'] = storageMode
+                        elif storageMode == 'delta' and base is not None:
+                            metadata.update(
+                                self._write_delta(z, prjPath, f, base)
+                            )
+                        else:
+                            self._write_project(z, prjPath, f)
+                    metadata['size'] = f.bytesRead
+                    metadata['sha256'] = hasher.hexdigest()
+                    if scanner is not None:
+                        metadata.update(scanner.close())
+
+                    # Write descriptive text file.
+                    z.writestr(
+                        (
+                            f'{self._sanitize_filename(title)}'
+                            f'{self.DESC_EXTENSION}'
+                        ),
+                        f'{title}\n\n{comment}',
+                    )
+
+                    # Write JSON metadata file.
+                    z.writestr(
+                        self.META_FILE,
+                        json.dumps({snapshotId: metadata}),
+                    )
+                zipFile.flush()
+                os.fsync(zipFile.fileno())
+            os.replace(tempPath, self.filePath)
+        except:
+            try:
+                os.remove(tempPath)
+            except OSError:
+                pass
+            raise
+
+    def _check_project(self, metadata, size, hasher):
+        # Return a list of the differences between the metadata
+        # and the size and hash of a project file.
+        problems = []
+        if metadata.get('size', size) != size:
+            problems.append('Project file size mismatch')
+        if metadata.get('sha256', hasher.hexdigest()) != hasher.hexdigest():
+            problems.append('Project file hash mismatch')
+        return problems
+
+    def _get_metadata(self):
+        # Return the metadata of the archive's snapshot.
+        return next(iter(self.read_metadata().values()))
+
+    def _get_project_name(self, z):
+        # Return the project file name from the open archive.
+        referenceFile = self._get_reference_file(z)
+        if referenceFile is not None:
+            return json.loads(z.read(referenceFile))['file']
+
+        for member in z.namelist():
+            if member == self.META_FILE:
+                continue
+
+            if member.endswith(self.DESC_EXTENSION):
+                continue
+
+            return member
+
+        raise FileNotFoundError('Project file is missing')
+
+    def _get_reference_file(self, z):
+        # Return the name of the member that replaces the project file.
+        # Return None, if the project file is stored as a whole.
+        members = z.namelist()
+        for referenceFile in (self.MANIFEST_FILE, self.DELTA_FILE):
+            if referenceFile in members:
+                return referenceFile
+
+        return None
+
+    def _sanitize_filename(self, filename):
+        # Return filename with disallowed characters removed.
+        return re.sub(r'[\\|\/|\:|\*|\?|\"|\<|\>|\|]+', '', filename)
+
+    def _write_delta(self, z, prjPath, f, base):
+        # Write the delta between the project file read from f
+        # and the base snapshot's project file into the archive.
+        # Return the metadata entries for the delta.
+        baseArchive = SnapshotArchive(base)
+        baseMetadata = baseArchive.read_metadata()
+        baseId = next(iter(baseMetadata))
+        chain = baseMetadata[baseId].get('chain', 0) + 1
+        ops, literals = make_delta(baseArchive.read_project(), f)
+        z.writestr(
+            self.DELTA_FILE,
+            json.dumps(
+                {
+                    'file': os.path.basename(prjPath),
+                    'size': f.bytesRead,
+                    'base': baseId,
+                    'ops': ops,
+                }
+            ),
+        )
+        z.writestr(
+            self.DELTA_DATA_FILE,
+            literals,
+        )
+        return {
+            'storage': 'delta',
+            'base': baseId,
+            'chain': chain,
+        }
+
+    def _write_manifest(self, z, prjPath, f):
+        # Put the chunks of the project file read from f
+        # into the object store and write the list of their keys
+        # into the archive.
+        keys = [self.store.put(chunk) for chunk in iter_novx_chunks(f)]
+        z.writestr(
+            self.MANIFEST_FILE,
+            json.dumps(
+                {
+                    'file': os.path.basename(prjPath),
+                    'size': f.bytesRead,
+                    'chunks': keys,
+                }
+            ),
+        )
+
+    def _write_project(self, z, prjPath, f):
+        # Copy the project file read from f into the archive
+        # chunk by chunk.
+        zipInfo = zipfile.ZipInfo.from_file(
+            prjPath,
+            arcname=os.path.basename(prjPath),
+        )
+        if prjPath.lower().endswith(self.COMPRESSED_EXTENSIONS):
+            zipInfo.compress_type = zipfile.ZIP_STORED
+        else:
+            zipInfo.compress_type = z.compression
+            # ZipInfo has no public attribute for the level
+            # before Python 3.13.
+            zipInfo._compresslevel = z.compresslevel
+        with z.open(zipInfo, 'w') as dst:
+            shutil.copyfileobj(f, dst, self.CHUNK_SIZE)
+
+
+def verify_archive(filePath):
+    """Return a list of the problems found in a snapshot archive.
+
+    Positional arguments:
+        filePath: str -- Path to the snapshot ZIP file.
+
+    This is the entry point for worker processes and threads.
+    """
+    return SnapshotArchive(filePath).verify()
+
+
+def verify_archives(
+        filePaths,
+        progress=None,
+        maxWorkers=None,
+        useThreads=False,
+):
+    """Check snapshot archives in parallel workers.
+
+    Positional arguments:
+        filePaths: list -- Paths to the snapshot ZIP files.
+
+    Optional arguments:
+        progress -- Callback function taking the number of archives
+                    checked and the total number of archives.
+        maxWorkers: int -- Maximum number of workers;
+                           default: the number of processors.
+                           If 1, the archives are checked
+                           in the calling process.
+        useThreads: bool -- If True, use worker threads
+                            instead of worker processes.
+
+    Return a dictionary: key: file path, value: list of problems.
+    If no worker processes can be started, the remaining archives
+    are checked in the calling process.
+    Worker threads are meant for applications that must not start
+    processes, e.g. a GUI running in a frozen interpreter.
+    Decompression and hashing release the GIL, so threads
+    still check archives in parallel.
+    """
+    results = {}
+    if maxWorkers != 1 and len(filePaths) > 1:
+        if useThreads:
+            executorClass = ThreadPoolExecutor
+        else:
+            executorClass = ProcessPoolExecutor
+        try:
+            with executorClass(max_workers=maxWorkers) as executor:
+                futures = {
+                    executor.submit(verify_archive, filePath): filePath
+                    for filePath in filePaths
+                }
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+                    if progress is not None:
+                        progress(len(results), len(filePaths))
+            return results
+
+        except (BrokenProcessPool, OSError):
+            pass
+
+    for filePath in filePaths:
+        if filePath in results:
+            continue
+
+        results[filePath] = verify_archive(filePath)
+        if progress is not None:
+            progress(len(results), len(filePaths))
+    return results
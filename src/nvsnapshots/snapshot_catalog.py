@@ -0,0 +1,531 @@
+"""Provide a class for a persistent snapshot metadata catalog.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+from collections import OrderedDict
+from datetime import datetime
+import glob
+import json
+import os
+
+from nvsnapshots.novx_scanner import get_chapter_digest
+from nvsnapshots.snapshot_archive import SnapshotArchive
+from nvsnapshots.snapshot_store import SnapshotStore
+
+
+class SnapshotCatalog:
+    """Cache the snapshot metadata of a project in the snapshot folder.
+
+    The catalog keeps the meta.json content of each snapshot archive,
+    keyed by file name, size, and modification time.
+    Only new or changed archives are opened when updating.
+
+    The results of archive verification are kept per file,
+    so unchanged archives are not verified again.
+
+    The free-text descriptions are not part of the list-level metadata.
+    They are kept in a separate file that is only loaded for searching.
+    Single descriptions are read from the archive on demand,
+    with a small LRU cache.
+
+    The chapter tables are not cached in the catalog either, because
+    they grow with the number of sections. The catalog keeps
+    a digest with one entry per chapter instead, so chapter overviews,
+    and the check whether two snapshots differ at all, need no archive.
+    The full tables are read from the archive's metadata on demand,
+    with a small LRU cache.
+    """
+    CATALOG_EXTENSION = '.catalog.json'
+    DESCRIPTIONS_EXTENSION = '.descriptions.json'
+    CATALOG_VERSION = 4
+    ZIP_EXTENSION = '.zip'
+    DESCRIPTION_CACHE_SIZE = 32
+    TABLE_CACHE_SIZE = 4
+
+    def __init__(self, snapshotDir, prjName):
+        """Set the catalog file path.
+
+        Positional arguments:
+            snapshotDir: str -- Path to the snapshot folder.
+            prjName: str -- Project file name without extension.
+        """
+        self.snapshotDir = snapshotDir
+        self.prjName = prjName
+        self.filePath = os.path.join(
+            snapshotDir,
+            f'{prjName}{self.CATALOG_EXTENSION}'
+        )
+        self.descriptionsPath = os.path.join(
+            snapshotDir,
+            f'{prjName}{self.DESCRIPTIONS_EXTENSION}'
+        )
+        self.entries = None
+        # dict: key = snapshot file name, value = catalog entry
+        self._descriptions = None
+        # dict: key = snapshot ID, value = description
+        self._recentDescriptions = OrderedDict()
+        # LRU cache: key = snapshot ID, value = description
+        self._recentTables = OrderedDict()
+        # LRU cache: key = snapshot ID, value = chapter table
+
+    def find_identical(self, prjPath):
+        """Return the ID of the latest snapshot, if identical to a file.
+
+        Positional arguments:
+            prjPath: str -- Path to the project file.
+
+        Return None, if the project file differs from the latest snapshot.
+        The file is hashed only if the sizes match.
+        """
+        snapshots = self.update()
+        if not snapshots:
+            return None
+
+        latestId = max(snapshots)
+        latest = snapshots[latestId]
+        if latest.get('size', None) != os.path.getsize(prjPath):
+            return None
+
+        if latest.get('sha256', None) != SnapshotArchive.hash_file(prjPath):
+            return None
+
+        return latestId
+
+    def get_archive_size(self, snapshotIds):
+        """Return the total size of the snapshots' archives in bytes.
+
+        Positional arguments:
+            snapshotIds -- Iterable of snapshot IDs.
+
+        The sizes are taken from the catalog.
+        """
+        if self.entries is None:
+            self.update()
+        size = 0
+        for snapshotId in snapshotIds:
+            entry = self.entries.get(
+                f'{snapshotId}{self.ZIP_EXTENSION}',
+                None
+            )
+            if entry is not None:
+                size += entry['size']
+        return size
+
+    def get_chapter_digest(self, snapshotId):
+        """Return the chapter digest of a snapshot from the catalog.
+
+        Positional arguments:
+            snapshotId: str -- ID of the snapshot.
+
+        Return None, if the snapshot has no chapter table.
+        See novx_scanner.get_chapter_digest().
+        """
+        if self.entries is None:
+            self.update()
+        entry = self.entries.get(f'{snapshotId}{self.ZIP_EXTENSION}', None)
+        if entry is None:
+            return None
+
+        return entry['metadata'].get(snapshotId, {}).get(
+            'chapter digest',
+            None
+        )
+
+    def get_chapter_table(self, snapshotId):
+        """Return the chapter table of a snapshot.
+
+        Positional arguments:
+            snapshotId: str -- ID of the snapshot.
+
+        Return None, if the snapshot has no chapter table.
+        """
+        if snapshotId in self._recentTables:
+            self._recentTables.move_to_end(snapshotId)
+            return self._recentTables[snapshotId]
+
+        try:
+            metadata = SnapshotArchive(
+                self.get_path(snapshotId)
+            ).read_metadata()
+            table = metadata[snapshotId].get('chapters', None)
+        except:
+            table = None
+        self._recentTables[snapshotId] = table
+        if len(self._recentTables) > self.TABLE_CACHE_SIZE:
+            self._recentTables.popitem(last=False)
+        return table
+
+    def get_delta_base(self, keyframeInterval):
+        """Return the path to the base archive for a delta snapshot.
+
+        Positional arguments:
+            keyframeInterval: int -- Maximum length of a delta chain.
+
+        Return None, if a keyframe with the full project file is due.
+        """
+        snapshots = self.update()
+        if not snapshots:
+            return None
+
+        latestId = max(snapshots)
+        chain = snapshots[latestId].get('chain', 0)
+        if chain + 1 >= keyframeInterval:
+            return None
+
+        return self.get_path(latestId)
+
+    def get_description(self, snapshotId):
+        """Return the description of a snapshot.
+
+        Positional arguments:
+            snapshotId: str -- ID of the snapshot.
+        """
+        if snapshotId in self._recentDescriptions:
+            self._recentDescriptions.move_to_end(snapshotId)
+            return self._recentDescriptions[snapshotId]
+
+        if (
+            self._descriptions is not None
+            and snapshotId in self._descriptions
+        ):
+            description = self._descriptions[snapshotId]
+        else:
+            try:
+                metadata = SnapshotArchive(
+                    self.get_path(snapshotId)
+                ).read_metadata()
+                description = metadata[snapshotId].get('description', '')
+            except:
+                description = ''
+        self._recentDescriptions[snapshotId] = description
+        if len(self._recentDescriptions) > self.DESCRIPTION_CACHE_SIZE:
+            self._recentDescriptions.popitem(last=False)
+        return description
+
+    def get_descriptions(self):
+        """Return a dictionary with the descriptions of all snapshots.
+
+        The descriptions stay loaded until release_descriptions()
+        is called.
+        """
+        if self._descriptions is None:
+            self._descriptions = self._read_descriptions()
+        return self._descriptions
+
+    def get_path(self, snapshotId):
+        """Return the path to the archive of a snapshot."""
+        return os.path.join(
+            self.snapshotDir,
+            f'{snapshotId}{self.ZIP_EXTENSION}'
+        )
+
+    def get_problems(self):
+        """Return the problems of the damaged archives found so far.
+
+        Return a dictionary: key: file name, value: list of problems.
+        """
+        if self.entries is None:
+            self.update()
+        return {
+            snapshotFile: entry['problems']
+            for snapshotFile, entry in self.entries.items()
+            if entry.get('problems', None)
+        }
+
+    def get_reclaimable_size(self, snapshotIds):
+        """Return the number of bytes freed by deleting snapshots.
+
+        Positional arguments:
+            snapshotIds -- Iterable of snapshot IDs.
+
+        This is the size of the snapshots' archives, plus the size
+        of the stored objects that no other snapshot refers to.
+        If an archive cannot be read, the objects are not counted.
+        """
+        snapshotIds = set(snapshotIds)
+        size = self.get_archive_size(snapshotIds)
+        try:
+            freedKeys = self._get_freed_keys(snapshotIds, self.update())
+        except:
+            return size
+
+        return size + SnapshotStore(self.snapshotDir).get_size(freedKeys)
+
+    def get_unverified(self, snapshotFiles=None):
+        """Return the archives that need to be verified.
+
+        Optional arguments:
+            snapshotFiles: list -- File names of archives to be verified
+                                   again, even if they were verified
+                                   before.
+
+        Return a dictionary: key: file name, value: size and
+        modification time of the cataloged archive.
+        Without snapshotFiles, archives that were verified
+        and have not changed since are omitted.
+        """
+        self.update()
+        if snapshotFiles is not None:
+            return {
+                snapshotFile: (
+                    self.entries[snapshotFile]['size'],
+                    self.entries[snapshotFile]['mtime'],
+                )
+                for snapshotFile in snapshotFiles
+                if snapshotFile in self.entries
+            }
+
+        return {
+            snapshotFile: (entry['size'], entry['mtime'])
+            for snapshotFile, entry in self.entries.items()
+            if 'problems' not in entry
+        }
+
+    def new_snapshot(self, prjPath):
+        """Return ID and ISO date for a snapshot of the project file.
+
+        Positional arguments:
+            prjPath: str -- Path to the project file.
+
+        The snapshot is dated with the project file's modification time.
+        """
+        prjFileDate = datetime.fromtimestamp(os.path.getmtime(prjPath))
+        isoDate = prjFileDate.replace(microsecond=0).isoformat()
+        return f"{self.prjName}.{isoDate.replace(':', '.')}", isoDate
+
+    def read(self):
+        """Load the catalog file, if any.
+
+        A missing or unreadable catalog is treated as empty.
+        """
+        self.entries = {}
+        try:
+            with open(self.filePath, 'r', encoding='utf-8') as f:
+                catalog = json.load(f)
+            if catalog.get('version') == self.CATALOG_VERSION:
+                self.entries = catalog['files']
+        except:
+            pass
+
+    def release_descriptions(self):
+        """Unload the descriptions loaded by get_descriptions()."""
+        self._descriptions = None
+
+    def remove(self, snapshotIds, snapshots=None):
+        """Delete snapshot archives.
+
+        Positional arguments:
+            snapshotIds -- Iterable of the IDs of the snapshots to delete.
+
+        Optional arguments:
+            snapshots: dict -- Metadata of all snapshots, as returned
+                               by update(). If given, the catalog
+                               is not accessed, so this method
+                               can run in a background thread.
+
+        Delta snapshots that are kept, but based on a deleted snapshot,
+        get the full project file first.
+        Stored objects that only deleted snapshots refer to
+        are deleted as well. If an archive cannot be read,
+        all objects are kept.
+        """
+        snapshotIds = set(snapshotIds)
+        if snapshots is None:
+            snapshots = self.update()
+        for dependentId in snapshots:
+            if dependentId in snapshotIds:
+                continue
+
+            if snapshots[dependentId].get('base', None) in snapshotIds:
+                SnapshotArchive(self.get_path(dependentId)).make_keyframe()
+        try:
+            freedKeys = self._get_freed_keys(snapshotIds, snapshots)
+        except:
+            freedKeys = set()
+        for snapshotId in snapshotIds:
+            os.remove(self.get_path(snapshotId))
+        SnapshotStore(self.snapshotDir).remove(freedKeys)
+
+    def set_verified(self, unverified, results):
+        """Store verification results in the catalog.
+
+        Positional arguments:
+            unverified: dict -- As returned by get_unverified()
+                                before verifying.
+            results: dict -- key: file name, value: list of problems.
+
+        Results for archives that changed meanwhile are discarded.
+        """
+        self.update()
+        for snapshotFile, problems in results.items():
+            entry = self.entries.get(snapshotFile, None)
+            if entry is None:
+                continue
+
+            if (entry['size'], entry['mtime']) != unverified[snapshotFile]:
+                continue
+
+            entry['problems'] = problems
+        self.write()
+
+    def update(self):
+        """Synchronize the catalog with the snapshot folder.
+
+        Return a dictionary with the snapshot metadata
+        without descriptions, sorted by snapshot file name.
+        """
+        if self.entries is None:
+            self.read()
+        if not os.path.isdir(self.snapshotDir):
+            return {}
+
+        snapshotFiles = glob.glob(
+            f'{self.prjName}.*{self.ZIP_EXTENSION}',
+            root_dir=self.snapshotDir,
+        )
+        snapshotFiles.sort()
+        isModified = False
+        newDescriptions = {}
+        removedIds = []
+
+        # Drop entries for deleted files.
+        existingFiles = set(snapshotFiles)
+        for snapshotFile in list(self.entries):
+            if snapshotFile not in existingFiles:
+                for snapshotId in self.entries[snapshotFile]['metadata']:
+                    removedIds.append(snapshotId)
+                    self._recentTables.pop(snapshotId, None)
+                del self.entries[snapshotFile]
+                isModified = True
+
+        # Read new or changed archives.
+        snapshots = {}
+        for snapshotFile in snapshotFiles:
+            zipPath = os.path.join(self.snapshotDir, snapshotFile)
+            try:
+                fileStat = os.stat(zipPath)
+            except OSError:
+                continue
+
+            entry = self.entries.get(snapshotFile, None)
+            if (
+                entry is None
+                or entry['size'] != fileStat.st_size
+                or entry['mtime'] != fileStat.st_mtime_ns
+            ):
+                metadata = self._read_metadata(zipPath)
+                for snapshotId in metadata:
+                    newDescriptions[snapshotId] = metadata[snapshotId].pop(
+                        'description',
+                        ''
+                    )
+                    table = metadata[snapshotId].pop('chapters', None)
+                    if table is not None:
+                        metadata[snapshotId]['chapter digest'] = (
+                            get_chapter_digest(table)
+                        )
+                    self._recentDescriptions.pop(snapshotId, None)
+                    self._recentTables.pop(snapshotId, None)
+                entry = {
+                    'size': fileStat.st_size,
+                    'mtime': fileStat.st_mtime_ns,
+                    'metadata': metadata,
+                }
+                self.entries[snapshotFile] = entry
+                isModified = True
+            snapshots |= entry['metadata']
+
+        if isModified:
+            self.write()
+        if newDescriptions or removedIds:
+            self._update_descriptions(newDescriptions, removedIds)
+        return snapshots
+
+    def write(self):
+        """Save the catalog file.
+
+        The catalog is a cache, so failures are ignored.
+        """
+        self._write_json(
+            self.filePath,
+            {
+                'version': self.CATALOG_VERSION,
+                'files': self.entries,
+            },
+        )
+
+    def _get_freed_keys(self, snapshotIds, snapshots):
+        # Return a set with the keys of the stored objects
+        # that only the snapshots with the IDs refer to.
+        # Only deduplicated snapshots are opened.
+        freedKeys = set()
+        for snapshotId in snapshotIds:
+            if snapshots.get(snapshotId, {}).get('storage', None) == 'dedup':
+                freedKeys.update(
+                    SnapshotArchive(self.get_path(snapshotId)).get_chunk_keys()
+                )
+        if not freedKeys:
+            return freedKeys
+
+        for snapshotId in snapshots:
+            if snapshotId in snapshotIds:
+                continue
+
+            if snapshots[snapshotId].get('storage', None) == 'dedup':
+                freedKeys.difference_update(
+                    SnapshotArchive(self.get_path(snapshotId)).get_chunk_keys()
+                )
+        return freedKeys
+
+    def _read_descriptions(self):
+        # Return the content of the descriptions file.
+        # A missing or unreadable file is treated as empty.
+        try:
+            with open(self.descriptionsPath, 'r', encoding='utf-8') as f:
+                descriptions = json.load(f)
+            if descriptions.get('version') == self.CATALOG_VERSION:
+                return descriptions['descriptions']
+
+        except:
+            pass
+        return {}
+
+    def _read_metadata(self, zipPath):
+        # Return the meta.json content of a snapshot archive.
+        # Unreadable archives are cataloged with empty metadata,
+        # so they are not opened again unless they change.
+        try:
+            return SnapshotArchive(zipPath).read_metadata()
+        except:
+            return {}
+
+    def _update_descriptions(self, newDescriptions, removedIds):
+        # Add new and remove deleted snapshots' descriptions,
+        # and save the descriptions file.
+        # The file content is kept only if it was loaded for searching.
+        descriptions = self._descriptions
+        if descriptions is None:
+            descriptions = self._read_descriptions()
+        for snapshotId in removedIds:
+            descriptions.pop(snapshotId, None)
+            self._recentDescriptions.pop(snapshotId, None)
+        descriptions.update(newDescriptions)
+        self._write_json(
+            self.descriptionsPath,
+            {
+                'version': self.CATALOG_VERSION,
+                'descriptions': descriptions,
+            },
+        )
+
+    def _write_json(self, filePath, data):
+        # Replace a JSON file; ignore failures.
+        tempPath = f'{filePath}.tmp'
+        try:
+            with open(tempPath, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tempPath, filePath)
+        except:
+            pass
@@ -0,0 +1,103 @@
+"""Provide functions for configurable snapshot compression.
+
+A compression is specified by a string:
+- "stored": No compression.
+- "deflate:N": Deflate with level N (1..9).
+- "bzip2:N": bzip2 with level N (1..9).
+- "lzma": LZMA.
+The level may be omitted for the default level.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+import io
+import time
+import zipfile
+
+COMPRESSION_TYPES = {
+    'stored': zipfile.ZIP_STORED,
+    'deflate': zipfile.ZIP_DEFLATED,
+    'bzip2': zipfile.ZIP_BZIP2,
+    'lzma': zipfile.ZIP_LZMA,
+}
+DEFAULT_COMPRESSION = 'deflate'
+BENCHMARK_SPECS = (
+    'stored',
+    'deflate:1',
+    'deflate:6',
+    'deflate:9',
+    'bzip2:9',
+    'lzma',
+)
+
+
+def parse_compression(spec):
+    """Return the ZIP compression type and level of a specification.
+
+    Positional arguments:
+        spec: str -- Compression specification, e.g. "deflate:9".
+
+    Invalid specifications fall back to the default deflate compression.
+    The level is None for the default level.
+    """
+    name, __, level = str(spec).strip().lower().partition(':')
+    if name not in COMPRESSION_TYPES:
+        return COMPRESSION_TYPES[DEFAULT_COMPRESSION], None
+
+    compressType = COMPRESSION_TYPES[name]
+    if compressType not in (zipfile.ZIP_DEFLATED, zipfile.ZIP_BZIP2):
+        return compressType, None
+
+    try:
+        level = int(level)
+    except ValueError:
+        return compressType, None
+
+    return compressType, min(max(level, 1), 9)
+
+
+def run_benchmark(filePath, specs=BENCHMARK_SPECS, progress=None):
+    """Compress a file with several settings and return the results.
+
+    Positional arguments:
+        filePath: str -- Path to the file to compress.
+
+    Optional arguments:
+        specs -- Iterable of compression specifications.
+        progress -- Callback function taking the number of settings
+                    done and the total number of settings.
+
+    Return a list of (specification, seconds, compressed size,
+    uncompressed size) tuples.
+    The file is compressed in memory, so nothing is written to disk.
+    """
+    with open(filePath, 'rb') as f:
+        data = f.read()
+    results = []
+    for i, spec in enumerate(specs):
+        compressType, level = parse_compression(spec)
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        with zipfile.ZipFile(
+            buffer,
+            'w',
+            compression=compressType,
+            compresslevel=level,
+        ) as z:
+            z.writestr('project', data)
+        seconds = time.perf_counter() - start
+        results.append((spec, seconds, len(buffer.getvalue()), len(data)))
+        if progress is not None:
+            progress(i + 1, len(specs))
+    return results
+
+
+def format_benchmark(results):
+    """Return a list of report lines for benchmark results."""
+    lines = []
+    for spec, seconds, size, originalSize in results:
+        throughput = originalSize / max(seconds, 1e-9) / 1024 / 1024
+        ratio = 100 * size / max(originalSize, 1)
+        lines.append(f'{spec}: {throughput:.1f} MiB/s, {ratio:.1f}%')
+    return lines
@@ -0,0 +1,75 @@
+"""Provide functions for binary deltas between project file versions.
+
+A delta is a list of operations and a string of literal bytes.
+Each operation is an [offset, length] pair:
+- offset >= 0: Copy length bytes from the base content at offset.
+- offset == -1: Take the next length bytes from the literal bytes.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+import hashlib
+import io
+
+from nvsnapshots.snapshot_store import iter_novx_chunks
+
+
+def apply_delta(base, ops, literals):
+    """Return the content rebuilt from the base content and a delta.
+
+    Positional arguments:
+        base: bytes -- Content of the base version.
+        ops: list -- Delta operations.
+        literals: bytes -- Literal bytes of the delta.
+    """
+    parts = []
+    literalPos = 0
+    for offset, length in ops:
+        if offset < 0:
+            parts.append(literals[literalPos:literalPos + length])
+            literalPos += length
+        else:
+            parts.append(base[offset:offset + length])
+    return b''.join(parts)
+
+
+def make_delta(base, f):
+    """Return the operations and the literal bytes of a delta.
+
+    Positional arguments:
+        base: bytes -- Content of the base version.
+        f -- Binary file object with the new version.
+
+    Chapters and sections are matched as a whole, so the delta size
+    grows with the size of the changed sections.
+    """
+    baseChunks = {}
+    offset = 0
+    for chunk in iter_novx_chunks(io.BytesIO(base)):
+        baseChunks.setdefault(hashlib.sha1(chunk).digest(), offset)
+        offset += len(chunk)
+
+    ops = []
+    literals = []
+    for chunk in iter_novx_chunks(f):
+        offset = baseChunks.get(hashlib.sha1(chunk).digest(), -1)
+        if ops:
+            prevOffset, prevLength = ops[-1]
+            if offset < 0 and prevOffset < 0:
+                ops[-1][1] += len(chunk)
+                literals.append(chunk)
+                continue
+
+            if (
+                offset >= 0
+                and prevOffset >= 0
+                and prevOffset + prevLength == offset
+            ):
+                ops[-1][1] += len(chunk)
+                continue
+
+        ops.append([offset, len(chunk)])
+        if offset < 0:
+            literals.append(chunk)
+    return ops, b''.join(literals)
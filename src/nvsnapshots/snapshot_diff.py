@@ -0,0 +1,166 @@
+"""Provide functions for comparing snapshots section by section.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+import difflib
+
+from nvsnapshots.novx_scanner import get_chapter_table
+from nvsnapshots.novx_scanner import get_paragraphs
+from nvsnapshots.nvsnapshots_locale import _
+
+CONTEXT_LINES = 1
+
+
+def compare_snapshots(
+        oldArchive,
+        newArchive,
+        oldTable=None,
+        newTable=None,
+):
+    """Return the differences between two snapshots as report lines.
+
+    Positional arguments:
+        oldArchive: SnapshotArchive -- The older snapshot.
+        newArchive: SnapshotArchive -- The newer snapshot.
+
+    Optional arguments:
+        oldTable: list -- Chapter table from the older snapshot's metadata.
+        newTable: list -- Chapter table from the newer snapshot's metadata.
+
+    Chapters and sections are matched by ID. Unchanged sections
+    are recognized by their hashes, so only the changed sections
+    are read and compared as text. Missing tables are collected
+    by scanning the archive.
+    Return an empty list, if there are no differences.
+    """
+    if not oldTable:
+        oldTable = get_chapter_table(oldArchive.scan_project().chapters)
+    if not newTable:
+        newTable = get_chapter_table(newArchive.scan_project().chapters)
+    oldChapters, oldSections = _index_table(oldTable)
+    newChapters, newSections = _index_table(newTable)
+    changedChapters = _get_changed(oldChapters, newChapters)
+    changedSections = _get_changed(oldSections, newSections)
+    if not changedChapters and not changedSections:
+        return []
+
+    # Read only the changed elements, and the chapters
+    # of the changed sections for their titles.
+    keepIds = changedChapters | changedSections
+    for sections in (oldSections, newSections):
+        for scId in changedSections:
+            if scId in sections:
+                keepIds.add(sections[scId][0])
+    oldElements = oldArchive.scan_project(keepIds).elements
+    newElements = newArchive.scan_project(keepIds).elements
+
+    # Group the changed sections by chapter.
+    # Removed sections are listed in their former chapter.
+    chapterSections = {}
+    for scId in newSections:
+        if scId in changedSections:
+            chId = newSections[scId][0]
+            chapterSections.setdefault(chId, []).append(scId)
+    for scId in oldSections:
+        if scId not in newSections:
+            chId = oldSections[scId][0]
+            chapterSections.setdefault(chId, []).append(scId)
+
+    chapterIds = list(newChapters)
+    chapterIds.extend(chId for chId in oldChapters if chId not in newChapters)
+    lines = []
+    for chId in chapterIds:
+        if chId not in changedChapters and chId not in chapterSections:
+            continue
+
+        if chId in changedChapters:
+            lines.extend(
+                _get_header(
+                    _('Chapter'),
+                    chId,
+                    oldElements.get(chId, None),
+                    newElements.get(chId, None),
+                )
+            )
+        else:
+            lines.append(
+                f'=== {_("Chapter")} {chId}: '
+                f'"{newElements[chId].findtext("Title", "")}"'
+            )
+        for scId in chapterSections.get(chId, []):
+            lines.extend(
+                _compare_section(
+                    scId,
+                    oldElements.get(scId, None),
+                    newElements.get(scId, None),
+                )
+            )
+    return lines
+
+
+def _compare_section(scId, oldElement, newElement):
+    # Return the report lines for a changed section.
+    lines = _get_header(_('Section'), scId, oldElement, newElement)
+    oldParagraphs = _get_section_paragraphs(oldElement)
+    newParagraphs = _get_section_paragraphs(newElement)
+    diff = difflib.unified_diff(
+        oldParagraphs,
+        newParagraphs,
+        n=CONTEXT_LINES,
+        lineterm='',
+    )
+    for i, line in enumerate(diff):
+        if i > 1:
+            # The file headers are replaced by the section headers.
+            lines.append(line)
+    return lines
+
+
+def _get_changed(oldEntries, newEntries):
+    # Return a set with the IDs of the added, removed, or changed entries.
+    return {
+        entryId for entryId in oldEntries.keys() | newEntries.keys()
+        if oldEntries.get(entryId, None) != newEntries.get(entryId, None)
+    }
+
+
+def _get_header(kind, elementId, oldElement, newElement):
+    # Return the old and new header lines for a chapter or section.
+    lines = []
+    for prefix, element in (('---', oldElement), ('+++', newElement)):
+        if element is None:
+            lines.append(f'{prefix} {kind} {elementId}: -')
+        else:
+            lines.append(
+                f'{prefix} {kind} {elementId}: '
+                f'"{element.findtext("Title", "")}"'
+            )
+    return lines
+
+
+def _get_section_paragraphs(element):
+    # Return the paragraphs of a section element.
+    if element is None:
+        return []
+
+    content = element.find('Content')
+    if content is None:
+        return []
+
+    return get_paragraphs(content)
+
+
+def _index_table(table):
+    # Return dictionaries with the chapter and section entries
+    # of a chapter table, in the order of the table.
+    # Chapters: key = ID, value = title hash.
+    # Sections: key = ID, value = (chapter ID, title hash, content hash).
+    chapters = {}
+    sections = {}
+    for chId, chTitleHash, __, chSections in table:
+        chapters[chId] = chTitleHash
+        for scId, scTitleHash, __, contentHash in chSections:
+            sections[scId] = (chId, scTitleHash, contentHash)
+    return chapters, sections
@@ -0,0 +1,111 @@
+"""Provide a class for snapshot retention rules.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+from datetime import datetime
+from datetime import timedelta
+
+from nvsnapshots.nvsnapshots_locale import _
+
+
+class RetentionPolicy:
+    """Select the snapshots to delete when thinning out a snapshot folder.
+
+    - All snapshots younger than keepAllHours are kept.
+    - Of the snapshots younger than keepDailyDays,
+      the latest per day is kept.
+    - Of the older snapshots, the latest per week is kept.
+      If keepWeeklyWeeks is not zero, weekly snapshots older than
+      that many weeks are deleted.
+    - The latest snapshot is always kept.
+    - If keepTitled is set, snapshots with a title given by the user
+      are always kept. Snapshots are untitled if their metadata
+      has the "auto" flag set, or if their title is one
+      of the default titles, in English or in the current language.
+    - Snapshots without a valid date are always kept.
+
+    Only the list-level metadata is used, so no archive is opened.
+    """
+
+    def __init__(
+            self,
+            keepAllHours=48,
+            keepDailyDays=30,
+            keepWeeklyWeeks=0,
+            keepTitled=True,
+    ):
+        self.keepAll = timedelta(hours=keepAllHours)
+        self.keepDaily = timedelta(days=keepDailyDays)
+        self.keepWeekly = timedelta(weeks=keepWeeklyWeeks)
+        self.keepTitled = keepTitled
+        self.untitled = {
+            'Undefined',
+            'Auto-generated snapshot',
+            _('Undefined'),
+            _('Auto-generated snapshot'),
+        }
+
+    def get_obsolete(self, snapshots, now=None):
+        """Return a sorted list with the IDs of the snapshots to delete.
+
+        Positional arguments:
+            snapshots: dict -- key: snapshot ID, value: metadata.
+
+        Optional arguments:
+            now: datetime -- Reference time; default: current time.
+        """
+        if now is None:
+            now = datetime.now()
+        dated = []
+        for snapshotId, metadata in snapshots.items():
+            try:
+                date = datetime.fromisoformat(metadata['date'])
+            except:
+                continue
+
+            dated.append((date, snapshotId))
+        dated.sort(reverse=True)
+
+        obsoleteIds = []
+        keptDays = set()
+        keptWeeks = set()
+        for i, (date, snapshotId) in enumerate(dated):
+            if i == 0:
+                # The latest snapshot.
+                continue
+
+            if self.keepTitled and self._is_titled(snapshots[snapshotId]):
+                continue
+
+            age = now - date
+            week = date.isocalendar()[:2]
+            if age < self.keepAll:
+                keptDays.add(date.date())
+                keptWeeks.add(week)
+                continue
+
+            if age < self.keepDaily:
+                day = date.date()
+                if day not in keptDays:
+                    keptDays.add(day)
+                    keptWeeks.add(week)
+                    continue
+
+            elif not self.keepWeekly or age < self.keepWeekly:
+                if week not in keptWeeks:
+                    keptWeeks.add(week)
+                    continue
+
+            obsoleteIds.append(snapshotId)
+        obsoleteIds.sort()
+        return obsoleteIds
+
+    def _is_titled(self, metadata):
+        # Return True if the snapshot has a title given by the user.
+        if metadata.get('auto', False):
+            return False
+
+        title = metadata.get('title', '')
+        return bool(title) and title not in self.untitled
@@ -0,0 +1,128 @@
+"""Provide a class for automatic snapshots.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+import os
+import time
+
+
+class SnapshotScheduler:
+    """Request snapshots on an interval, after a number of saves,
+    or after saves with significant changes.
+
+    The project file is checked periodically. Saves are detected
+    by the file's modification time, so a burst of saves results
+    in a single snapshot.
+    Snapshots are only requested while the user is idle, i.e.
+    when there was no key press or mouse click for a while.
+    """
+    CHECK_INTERVAL = 5000
+    # milliseconds
+
+    def __init__(self, root, prefs, onDue, isChanged=None):
+        """Set up the activity tracking.
+
+        Positional arguments:
+            root -- Tk root window.
+            prefs: dict -- Settings with auto_snapshot_interval (minutes),
+                           auto_snapshot_saves, auto_snapshot_on_save,
+                           and auto_snapshot_idle (seconds).
+            onDue -- Callback requesting a snapshot. Returns False
+                     if the snapshot must be requested again later.
+
+        Optional arguments:
+            isChanged -- Callback returning True if the saved changes
+                         are significant. Used with auto_snapshot_on_save.
+        """
+        self._root = root
+        self._prefs = prefs
+        self._onDue = onDue
+        self._isChanged = isChanged
+        self._prjPath = None
+        self._checkJob = None
+        self._mtime = None
+        self._saves = 0
+        self._lastSnapshot = 0
+        self._lastActivity = time.monotonic()
+        for sequence in ('<KeyPress>', '<ButtonPress>'):
+            root.bind_all(sequence, self._on_activity, add='+')
+
+    def start(self, prjPath):
+        """Start watching a project file.
+
+        Positional arguments:
+            prjPath: str -- Path to the project file.
+
+        Do nothing, if automatic snapshots are not configured.
+        """
+        self.stop()
+        interval = float(self._prefs['auto_snapshot_interval'])
+        saves = int(self._prefs['auto_snapshot_saves'])
+        if (
+            interval <= 0
+            and saves <= 0
+            and not self._prefs['auto_snapshot_on_save']
+        ):
+            return
+
+        self._prjPath = prjPath
+        try:
+            self._mtime = os.stat(prjPath).st_mtime_ns
+        except OSError:
+            self._mtime = None
+        self._saves = 0
+        self._lastSnapshot = time.monotonic()
+        self._checkJob = self._root.after(self.CHECK_INTERVAL, self._check)
+
+    def stop(self):
+        """Stop watching the project file."""
+        if self._checkJob is not None:
+            self._root.after_cancel(self._checkJob)
+            self._checkJob = None
+        self._prjPath = None
+
+    def _check(self):
+        # Count the saves since the last check,
+        # and request a snapshot if one is due.
+        self._checkJob = self._root.after(self.CHECK_INTERVAL, self._check)
+        try:
+            mtime = os.stat(self._prjPath).st_mtime_ns
+        except OSError:
+            return
+
+        if mtime != self._mtime:
+            self._mtime = mtime
+            self._saves += 1
+        if not self._saves:
+            return
+
+        now = time.monotonic()
+        idle = float(self._prefs['auto_snapshot_idle'])
+        if now - self._lastActivity < idle:
+            return
+
+        interval = float(self._prefs['auto_snapshot_interval']) * 60
+        saves = int(self._prefs['auto_snapshot_saves'])
+        isDue = (
+            (interval > 0 and now - self._lastSnapshot >= interval)
+            or (saves > 0 and self._saves >= saves)
+        )
+        if (
+            not isDue
+            and self._prefs['auto_snapshot_on_save']
+            and self._isChanged is not None
+        ):
+            # The saves are accumulated until the changes
+            # are significant.
+            isDue = self._isChanged()
+        if not isDue:
+            return
+
+        if self._onDue():
+            self._saves = 0
+            self._lastSnapshot = now
+
+    def _on_activity(self, event=None):
+        self._lastActivity = time.monotonic()
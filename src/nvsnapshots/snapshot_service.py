@@ -4,16 +4,14 @@ Copyright (c) Peter Triesberger
 For further information see https://github.com/peter88213/nv_snapshots
 License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
 """
-from datetime import datetime
+from collections import OrderedDict
 import glob
-import json
 import os
-from pathlib import Path
-import re
 import sys
-import zipfile
+import tempfile
 
 from nvlib.controller.sub_controller import SubController
+from nvlib.novx_globals import CH_ROOT
 from nvlib.novx_globals import CHAPTERS_SUFFIX
 from nvlib.novx_globals import CHARACTERS_SUFFIX
 from nvlib.novx_globals import DATA_SUFFIX
@@ -26,35 +24,53 @@ from nvlib.novx_globals import PLOTLINES_SUFFIX
 from nvlib.novx_globals import SECTIONS_SUFFIX
 from nvlib.novx_globals import STAGES_SUFFIX
 from nvlib.novx_globals import norm_path
+from nvsnapshots.novx_scanner import ChapterSummary
+from nvsnapshots.novx_scanner import get_chapter_table
+from nvsnapshots.novx_scanner import get_section_summary
 from nvsnapshots.nvsnapshots_globals import FEATURE
 from nvsnapshots.nvsnapshots_globals import open_document
 from nvsnapshots.nvsnapshots_help import Nvsnapshotshelp
 from nvsnapshots.nvsnapshots_locale import _
+from nvsnapshots.nvsnapshots_settings import OPTIONS
+from nvsnapshots.nvsnapshots_settings import SETTINGS
+from nvsnapshots.nvsnapshots_settings import get_ini_path
+from nvsnapshots.partial_restore_dialog import PartialRestoreDialog
 from nvsnapshots.platform.platform_settings import KEYS
+from nvsnapshots.section_change_tracker import SectionChangeTracker
+from nvsnapshots.snapshot_archive import SnapshotArchive
+from nvsnapshots.snapshot_archive import verify_archives
+from nvsnapshots.snapshot_catalog import SnapshotCatalog
+from nvsnapshots.snapshot_compression import format_benchmark
+from nvsnapshots.snapshot_compression import run_benchmark
 from nvsnapshots.snapshot_dialog import SnapshotDialog
+from nvsnapshots.snapshot_diff import compare_snapshots
+from nvsnapshots.snapshot_retention import RetentionPolicy
+from nvsnapshots.snapshot_scheduler import SnapshotScheduler
+from nvsnapshots.snapshot_store import SnapshotStore
 from nvsnapshots.snapshot_view import SnapshotView
+from nvsnapshots.snapshot_writer import SnapshotWriter
 import tkinter as tk
 
 
 class SnapshotService(SubController):
-    INI_FILENAME = 'snapshots.ini'
-    INI_FILEPATH = '.novx/config'
-    SETTINGS = dict(
-        snapshot_subdir='Snapshots',
-        window_geometry='1270x250',
-        right_frame_width=350,
-        id_width=160,
-        title_width=240,
-        date_width=120,
-        words_used_width=55,
-        words_total_width=100,
-        work_phase_width=140,
-    )
-    OPTIONS = {}
     ICON = 'snapshot'
 
     ZIP_EXTENSION = '.zip'
-    DESC_EXTENSION = '.txt'
+    NOVEL_CACHE_SIZE = 3
+    PREVIEW_LINES = 20
+    EXPORT_SUFFIXES = (
+        MANUSCRIPT_SUFFIX,
+        PARTS_SUFFIX,
+        CHAPTERS_SUFFIX,
+        SECTIONS_SUFFIX,
+        STAGES_SUFFIX,
+        PLOTLINES_SUFFIX,
+        GRID_SUFFIX,
+        CHARACTERS_SUFFIX,
+        LOCATIONS_SUFFIX,
+        ITEMS_SUFFIX,
+        DATA_SUFFIX,
+    )
 
     def __init__(self, model, view, controller):
         self._mdl = model
@@ -62,15 +78,10 @@ class SnapshotService(SubController):
         self._ctrl = controller
 
         #--- Load configuration.
-        try:
-            homeDir = str(Path.home()).replace('\\', '/')
-            configDir = f'{homeDir}/{self.INI_FILEPATH}'
-        except:
-            configDir = '.'
         self.configuration = self._mdl.nvService.new_configuration(
-            settings=self.SETTINGS,
-            options=self.OPTIONS,
-            filePath=f'{configDir}/{self.INI_FILENAME}',
+            settings=SETTINGS,
+            options=OPTIONS,
+            filePath=get_ini_path(),
         )
         self.configuration.read()
         self.prefs = {}
@@ -88,6 +99,9 @@ class SnapshotService(SubController):
 
         self.snapshotView = None
         self.prjSnapshots = {}
+        self._catalog = None
+        self._novelCache = OrderedDict()
+        # LRU cache: key = (snapshot ID, archive mtime), value = novx file
 
         self._snapshotId = None
         self._isoDate = None
@@ -95,6 +109,18 @@ class SnapshotService(SubController):
         self._prjDir = None
         self._zipPath = None
 
+        self._writer = SnapshotWriter(
+            self._ui.root,
+            onError=self._report_error,
+        )
+        self._isExporting = False
+        self._scheduler = SnapshotScheduler(
+            self._ui.root,
+            self.prefs,
+            self._take_scheduled_snapshot,
+            isChanged=self._is_significant_change,
+        )
+        self._changeTracker = SectionChangeTracker()
         self._ui.root.bind('<<save_snapshot>>', self._save_snapshot)
         self.snapshotTitle = None
         self.snapshotComment = None
@@ -107,12 +133,35 @@ class SnapshotService(SubController):
         self.snapshotView.mainMenu.entryconfig(_('File'), state='normal')
         self.snapshotView.mainMenu.entryconfig(_('Export'), state='normal')
 
+    def get_description(self, snapshotId):
+        """Return the description of a snapshot, loaded on demand."""
+        if self._catalog is None:
+            return ''
+
+        return self._catalog.get_description(snapshotId)
+
+    def get_descriptions(self):
+        """Return a dictionary with the descriptions of all snapshots."""
+        if self._catalog is None:
+            return {}
+
+        return self._catalog.get_descriptions()
+
+    def release_descriptions(self):
+        """Unload the descriptions loaded for searching."""
+        if self._catalog is not None:
+            self._catalog.release_descriptions()
+
     def make_snapshot(self, doNotAsk=False, event=None):
         self._ui.restore_status()
         self._ui.propertiesView.apply_changes()
         if self._mdl.prjFile is None:
             return
 
+        if self._writer.is_busy():
+            self._ui.set_status(f'#{_("Snapshot in progress")}.')
+            return
+
         if self._mdl.prjFile.filePath is None:
             if not self._ctrl.save_project():
                 return
@@ -136,13 +185,30 @@ class SnapshotService(SubController):
             self._ui.set_status(f'#{_("Snapshot already exists")}.')
             return
 
+        identicalId = self._find_identical_snapshot()
+        if identicalId is not None:
+            self._ui.set_status(
+                f'#{_("Snapshot already exists")}: "{identicalId}".'
+            )
+            return
+
         #--- Open a dialog for title/comment input.
         SnapshotDialog(self._ui, self)
 
     def on_close(self):
+        self._scheduler.stop()
         self.prjSnapshots.clear()
+        self._catalog = None
+        self._novelCache.clear()
         self.snapshotView.reset_tree()
 
+    def on_open(self):
+        self.refresh()
+        if self.prefs['auto_snapshot_on_save']:
+            # Changes are measured against the opened project.
+            self._changeTracker.set_snapshot(self._get_section_contents())
+        self._scheduler.start(self._mdl.prjFile.filePath)
+
     def on_quit(self):
         """Write back the configuration file.
         
@@ -186,6 +252,7 @@ class SnapshotService(SubController):
             self._ui,
             self._ctrl,
             self.prefs,
+            self,
         )
         if self.icon:
             self.snapshotView.iconphoto(False, self.icon)
@@ -195,7 +262,10 @@ class SnapshotService(SubController):
 
     def _bind_events(self):
         event_callbacks = {
+            '<<benchmark>>': self._run_benchmark,
             '<<clean_up>>': self._clean_up_snapshot_dir,
+            '<<compare_snapshots>>': self._compare_snapshots,
+            '<<export_all>>': self._export_all,
             '<<export_characters>>': self._export_characters,
             '<<export_chapters>>': self._export_chapters,
             '<<export_data>>': self._export_data,
@@ -205,12 +275,16 @@ class SnapshotService(SubController):
             '<<export_manuscript>>': self._export_manuscript,
             '<<export_sections>>': self._export_sections,
             '<<export_stages>>': self._export_stages,
+            '<<export_zip>>': self._export_zip,
             '<<export_parts>>': self._export_parts,
             '<<export_plotlines>>': self._export_plotlines,
             '<<make_snapshot>>': self.make_snapshot,
             '<<open_help>>': self._open_help,
+            '<<prune>>': self._prune_snapshots,
             '<<remove_snapshot>>': self._remove_snapshot,
+            '<<restore_parts>>': self._restore_parts,
             '<<revert>>': self._revert,
+            '<<verify_snapshots>>': self._verify_snapshots,
             '<<open_folder>>': self._open_folder,
         }
         for sequence, callback in event_callbacks.items():
@@ -225,11 +299,16 @@ class SnapshotService(SubController):
         if not os.path.isdir(snapshotDir):
             return
 
-        for pattern in (
+        patterns = [
             '*.bak',
             '*.od?',
             '*.xml',
-        ):
+        ]
+        isWriting = self._writer.is_busy()
+        if not isWriting:
+            # Temporary files left by interrupted writes.
+            patterns.append(f'*{SnapshotArchive.TEMP_EXTENSION}')
+        for pattern in patterns:
             for file in glob.iglob(
                 pattern,
                 root_dir=snapshotDir,
@@ -239,76 +318,146 @@ class SnapshotService(SubController):
                 except:
                     pass
 
-    def _collect_snapshots(self):
-        projectDir, projectFile = os.path.split(self._mdl.prjFile.filePath)
-        snapshotDir = os.path.join(projectDir, self.prefs['snapshot_subdir'])
-        if not os.path.isdir(snapshotDir):
+        if isWriting:
+            # The objects of a snapshot being written
+            # are not referenced yet.
             return
 
-        self.prjSnapshots.clear()
-        prjName, __ = os.path.splitext(projectFile)
-        prjSnapshotFiles = glob.glob(
-            f'{prjName}.*{self.ZIP_EXTENSION}',
-            root_dir=snapshotDir,
-        )
-        prjSnapshotFiles.sort()
-        if not prjSnapshotFiles:
+        # Remove objects that no deduplicated snapshot refers to.
+        store = SnapshotStore(snapshotDir)
+        if not os.path.isdir(store.storeDir):
             return
 
-        for snapshotFile in prjSnapshotFiles:
-            zipPath = os.path.join(snapshotDir, snapshotFile)
+        store.remove_temp_files()
+
+        referencedKeys = set()
+        for file in glob.iglob(
+            f'*{self.ZIP_EXTENSION}',
+            root_dir=snapshotDir,
+        ):
             try:
-                with zipfile.ZipFile(zipPath, 'r') as z:
-                    with z.open('meta.json', 'r') as f:
-                        metadata = json.loads(f.read())
-            except:
-                pass
-            else:
-                self.prjSnapshots |= metadata
+                referencedKeys.update(
+                    SnapshotArchive(
+                        os.path.join(snapshotDir, file)
+                    ).get_chunk_keys()
+                )
+            except Exception as ex:
+                # Keep all objects if a snapshot cannot be read.
+                self._ui.set_status(
+                    f'!{_("Can not clean up Snapshot folder")}: '
+                    f'{str(ex)}'
+                )
+                return
 
-    def _create_document(self, sourcePath, suffix, **kwargs):
-        """Create a document from any novx file.
-        
-        Positional arguments: 
-            sourcePath: str -- path to a novx file other than the 
-                               project file. 
-            suffix: str -- Target file name suffix.
-
-        Keyword arguments:
-            filter: str -- element ID for filtering chapters and sections.
-            show: Boolean -- If True, open the created document 
-                             after creation.
-            ask: Boolean -- If True, ask before opening 
-                            the created document.
-            overwrite: Boolean -- Overwrite existing files 
-                                  without confirmation.
-            doNotExport: Boolean -- Open existing, if any. Do not export.
-        """
+        store.remove_unreferenced(referencedKeys)
+
+    def _collect_snapshots(self):
+        if not os.path.isdir(self._get_snapshot_dir()):
+            return
+
+        self.prjSnapshots.clear()
+        self.prjSnapshots |= self._get_catalog().update()
+
+    def _compare_snapshots(self, event=None):
+        # Compare two selected snapshots in the background,
+        # and show the differences in a text document.
         self._ui.restore_status()
-        if not os.path.isfile(sourcePath):
-            self._ui.set_status(
-                f'!{_("File not found")}: '
-                f'"{norm_path(sourcePath)}".'
-            )
+        snapshotIds = sorted(self.snapshotView.get_selections())
+        if len(snapshotIds) != 2:
+            self._ui.set_status(f'#{_("Please select two snapshots")}.')
             return
 
-        __, extension = os.path.splitext(sourcePath)
-        if extension == self._mdl.nvService.get_novx_file_extension():
-            novxFile = self._mdl.nvService.new_novx_file(sourcePath)
-        elif extension == self._mdl.nvService.get_zipped_novx_file_extension():
-            novxFile = self._mdl.nvService.new_zipped_novx_file(sourcePath)
-        else:
-            self._ui.set_status(f'!{_("File type is not supported")}.')
+        if self._writer.is_busy():
+            self._ui.set_status(f'#{_("Snapshot in progress")}.')
+            return
+
+        oldId, newId = snapshotIds
+        catalog = self._get_catalog()
+        oldDigest = catalog.get_chapter_digest(oldId)
+        newDigest = catalog.get_chapter_digest(newId)
+        if oldDigest is not None and oldDigest == newDigest:
+            # The catalog shows that no chapter or section has changed.
+            self._ui.set_status(_('No changes'))
+            return
+
+        oldArchive = SnapshotArchive(self._get_zipfile_path(oldId))
+        newArchive = SnapshotArchive(self._get_zipfile_path(newId))
+        oldTable = catalog.get_chapter_table(oldId)
+        newTable = catalog.get_chapter_table(newId)
+        reportPath = os.path.join(
+            tempfile.gettempdir(),
+            f'{oldId}--{newId}.txt'
+        )
+
+        def compare(progress):
+            lines = compare_snapshots(
+                oldArchive,
+                newArchive,
+                oldTable=oldTable,
+                newTable=newTable,
+            )
+            if not lines:
+                return None
+
+            with open(reportPath, 'w', encoding='utf-8') as f:
+                f.write(f'--- {oldId}\n+++ {newId}\n\n')
+                f.write('\n'.join(lines))
+            return reportPath
+
+        def finish(result, error):
+            if self._mdl.prjFile is None:
+                # The project was closed meanwhile.
+                return
+
+            if error is not None:
+                self._ui.set_status(f'!{str(error)}')
+            elif result is None:
+                self._ui.set_status(_('No changes'))
+            else:
+                self._ui.set_status(f'{_("Snapshots compared")}.')
+                open_document(result)
+
+        self._ui.set_status(f'{_("Comparing snapshots")}...')
+        self._writer.submit(compare, onDone=finish)
+
+    def _delete_snapshots(self, snapshotIds):
+        # Delete snapshots in the background,
+        # and update the view once at the end.
+        catalog = self._get_catalog()
+        snapshots = self.prjSnapshots.copy()
+
+        def remove_snapshots(progress):
+            catalog.remove(snapshotIds, snapshots)
+
+        def finish(result, error):
+            if self._mdl.prjFile is None:
+                # The project was closed meanwhile.
+                return
+
+            if error is not None:
+                self._ui.set_status(
+                    f'!{_("Can not remove snapshot")}: '
+                    f'{str(error)}'
+                )
+            self.refresh()
+
+        self._writer.submit(remove_snapshots, onDone=finish)
+
+    def _export_document(self, suffix, show=True, event=None):
+        self._ui.restore_status()
+        snapshotId = self._get_single_selection()
+        if snapshotId is None:
             return
 
-        novxFile.novel = self._mdl.nvService.new_novel()
         try:
-            novxFile.read()
+            novxFile = self._read_snapshot(snapshotId)
             self._ui.set_status(
                 self._ctrl.fileManager.exporter.run(
                     novxFile,
                     suffix,
-                    **kwargs
+                    overwrite=True,
+                    ask=True,
+                    show=show,
                 )
             )
         except UserWarning as ex:
@@ -316,19 +465,57 @@ class SnapshotService(SubController):
         except Exception as ex:
             self._ui.set_status(f'!{str(ex)}')
 
-    def _export_document(self, suffix, show=True, event=None):
+    def _export_all(self, event=None):
+        # Export all documents from the selected snapshot.
+        # The snapshot is parsed once. The documents are written
+        # one by one from the event loop, so the window stays responsive.
         self._ui.restore_status()
-        snapshotId = self.snapshotView.get_selection()
+        if self._isExporting:
+            self._ui.set_status(f'#{_("Export in progress")}.')
+            return
+
+        snapshotId = self._get_single_selection()
         if snapshotId is None:
             return
 
-        self._create_document(
-            self._get_zipfile_path(snapshotId),
-            suffix,
-            overwrite=True,
-            ask=True,
-            show=show,
-        )
+        try:
+            novxFile = self._read_snapshot(snapshotId)
+        except Exception as ex:
+            self._ui.set_status(f'!{str(ex)}')
+            return
+
+        suffixes = list(self.EXPORT_SUFFIXES)
+        results = []
+
+        def export_next():
+            suffix = suffixes.pop(0)
+            try:
+                results.append(
+                    self._ctrl.fileManager.exporter.run(
+                        novxFile,
+                        suffix,
+                        overwrite=True,
+                        ask=False,
+                        show=False,
+                    )
+                )
+            except UserWarning as ex:
+                results.append(f'#{str(ex)}')
+            except Exception as ex:
+                results.append(f'!{str(ex)}')
+            if suffixes:
+                self._ui.set_status(
+                    f'{_("Exporting documents")}: '
+                    f'{len(results)}/{len(self.EXPORT_SUFFIXES)}'
+                )
+                self._ui.root.after(0, export_next)
+                return
+
+            self._isExporting = False
+            self._show_export_report(snapshotId, results)
+
+        self._isExporting = True
+        self._ui.root.after(0, export_next)
 
     def _export_characters(self, event=None):
         self._export_document(CHARACTERS_SUFFIX, event=event)
@@ -363,6 +550,156 @@ class SnapshotService(SubController):
     def _export_stages(self, event=None):
         self._export_document(STAGES_SUFFIX, event=event)
 
+    def _export_zip(self, event=None):
+        # Write self-contained archives of the selected snapshots
+        # to the project folder.
+        self._ui.restore_status()
+        snapshotIds = self.snapshotView.get_selections()
+        if not snapshotIds:
+            return
+
+        if self._writer.is_busy():
+            self._ui.set_status(f'#{_("Snapshot in progress")}.')
+            return
+
+        projectDir, __ = os.path.split(self._mdl.prjFile.filePath)
+        targetPaths = {}
+        for snapshotId in snapshotIds:
+            targetPaths[snapshotId] = os.path.join(
+                projectDir,
+                f'{snapshotId}{self.ZIP_EXTENSION}'
+            )
+        existingFiles = [
+            norm_path(targetPath) for targetPath in targetPaths.values()
+            if os.path.isfile(targetPath)
+        ]
+        if existingFiles:
+            if not self._ui.ask_yes_no(
+                message=_('Overwrite existing file?'),
+                detail='\n'.join(existingFiles),
+                title=FEATURE,
+                parent=self.snapshotView,
+            ):
+                self._ui.set_status(f'#{_("Action canceled by user")}.')
+                return
+
+        zipPaths = {
+            snapshotId: self._get_zipfile_path(snapshotId)
+            for snapshotId in snapshotIds
+        }
+
+        def export_archives(progress):
+            for i, snapshotId in enumerate(snapshotIds):
+                SnapshotArchive(zipPaths[snapshotId]).export_zip(
+                    targetPaths[snapshotId]
+                )
+                progress(i + 1, len(snapshotIds))
+
+        def show_progress(done, total):
+            self._ui.set_status(f'{_("Exporting snapshots")}: {done}/{total}')
+
+        def finish(result, error):
+            if self._mdl.prjFile is None:
+                # The project was closed meanwhile.
+                return
+
+            if error is not None:
+                message = f'!{_("Export failed")}: {str(error)}'
+            elif len(snapshotIds) == 1:
+                message = (
+                    f'{_("Snapshot exported")}: '
+                    f'"{norm_path(targetPaths[snapshotIds[0]])}"'
+                )
+            else:
+                message = (
+                    f'{_("Snapshots exported")}: {len(snapshotIds)} '
+                    f'"{norm_path(projectDir)}"'
+                )
+            self._ui.set_status(message)
+
+        self._writer.submit(
+            export_archives,
+            onProgress=show_progress,
+            onDone=finish,
+        )
+
+    def _find_identical_snapshot(self):
+        # Return the ID of the latest snapshot, if its project file
+        # is identical to the project file. Otherwise return None.
+        return self._get_catalog().find_identical(self._mdl.prjFile.filePath)
+
+    def _get_catalog(self):
+        # Return the snapshot catalog of the current project.
+        projectDir, projectFile = os.path.split(self._mdl.prjFile.filePath)
+        snapshotDir = os.path.join(projectDir, self.prefs['snapshot_subdir'])
+        prjName, __ = os.path.splitext(projectFile)
+        if (
+            self._catalog is None
+            or self._catalog.snapshotDir != snapshotDir
+            or self._catalog.prjName != prjName
+        ):
+            self._catalog = SnapshotCatalog(snapshotDir, prjName)
+        return self._catalog
+
+    def _get_delta_base(self):
+        # Return the path to the base archive for a delta snapshot.
+        # Return None, if a keyframe with the full project file is due.
+        return self._get_catalog().get_delta_base(
+            int(self.prefs['keyframe_interval'])
+        )
+
+    def _get_obsolete_snapshots(self):
+        # Return the IDs of the snapshots that the retention policy
+        # does not keep.
+        self._collect_snapshots()
+        policy = RetentionPolicy(
+            keepAllHours=float(self.prefs['keep_all_hours']),
+            keepDailyDays=float(self.prefs['keep_daily_days']),
+            keepWeeklyWeeks=float(self.prefs['keep_weekly_weeks']),
+            keepTitled=self.prefs['keep_titled'],
+        )
+        return policy.get_obsolete(self.prjSnapshots)
+
+    def _get_chapter_summaries(self):
+        # Return a list of ChapterSummary built from the model.
+        novel = self._mdl.novel
+        chapters = []
+        for chId in novel.tree.get_children(CH_ROOT):
+            chapter = novel.chapters[chId]
+            summary = ChapterSummary(
+                chId,
+                str(chapter.chType),
+                str(chapter.chLevel),
+                bool(chapter.isTrash),
+            )
+            summary.title = chapter.title or ''
+            for scId in novel.tree.get_children(chId):
+                section = novel.sections[scId]
+                summary.sections.append(
+                    get_section_summary(
+                        scId,
+                        section.title,
+                        section.scType,
+                        section.sectionContent,
+                    )
+                )
+            chapters.append(summary)
+        return chapters
+
+    def _get_section_contents(self):
+        # Return a dictionary with the section contents of the model.
+        sections = self._mdl.novel.sections
+        return {scId: sections[scId].sectionContent for scId in sections}
+
+    def _get_single_selection(self):
+        # Return the ID of the selected snapshot, or None.
+        # Commands for a single snapshot show a hint
+        # if several snapshots are selected.
+        snapshotId = self.snapshotView.get_selection()
+        if snapshotId is None and self.snapshotView.get_selections():
+            self._ui.set_status(f'#{_("Please select one snapshot")}.')
+        return snapshotId
+
     def _get_snapshot_dir(self):
         projectDir, __ = os.path.split(self._mdl.prjFile.filePath)
         return os.path.join(
@@ -379,13 +716,112 @@ class SnapshotService(SubController):
     def _initialize_snapshot(self):
         # Set iso date, ID, and path for the next snapshot.
         self._prjDir, self._prjFile = os.path.split(self._mdl.prjFile.filePath)
-        prjName, __ = os.path.splitext(self._prjFile)
-        prjFileTimestamp = os.path.getmtime(self._mdl.prjFile.filePath)
-        prjFileDate = (datetime.fromtimestamp(prjFileTimestamp))
-        self._isoDate = prjFileDate.replace(microsecond=0).isoformat()
-        self._snapshotId = f"{prjName}.{self._isoDate.replace(':', '.')}"
+        self._snapshotId, self._isoDate = self._get_catalog().new_snapshot(
+            self._mdl.prjFile.filePath
+        )
         self._zipPath = self._get_zipfile_path(self._snapshotId)
 
+    def _insert_node(self, parent, nodeId, siblingIds):
+        # Insert a chapter or section into the novel tree
+        # after the nearest sibling that precedes it in the snapshot.
+        tree = self._mdl.novel.tree
+        children = tree.get_children(parent)
+        index = 0
+        for siblingId in siblingIds[:siblingIds.index(nodeId)]:
+            if siblingId in children:
+                index = children.index(siblingId) + 1
+        tree.insert(parent, index, nodeId)
+
+    def _is_significant_change(self):
+        # Return True if enough words were changed
+        # since the last snapshot.
+        if self._mdl.prjFile is None or self._mdl.isModified:
+            return False
+
+        changedWords = self._changeTracker.get_changed_words(
+            self._get_section_contents()
+        )
+        return changedWords >= int(self.prefs['auto_snapshot_threshold'])
+
+    def _merge_elements(self, summary, elementIds):
+        # Restore chapters and sections from a snapshot into the model.
+        # Existing chapters and sections are overwritten in place;
+        # missing ones are inserted at their former position.
+        # Missing chapters of restored sections are restored as well,
+        # so the summary must contain their elements, too.
+        # Return the number of restored sections.
+        novel = self._mdl.novel
+        nvService = self._mdl.nvService
+        elements = summary.elements
+        chapterIds = [chapter.id for chapter in summary.chapters]
+        sectionCount = 0
+        isChanged = False
+        try:
+            for chapter in summary.chapters:
+                chId = chapter.id
+                if chId is None:
+                    continue
+
+                sectionIds = [
+                    section.id for section in chapter.sections
+                    if section.id in elementIds
+                ]
+                if chId not in elementIds and not sectionIds:
+                    continue
+
+                if chId not in novel.chapters:
+                    newChapter = nvService.new_chapter(
+                        on_element_change=self._mdl.on_element_change,
+                    )
+                    newChapter.from_xml(elements[chId])
+                    novel.chapters[chId] = newChapter
+                    isChanged = True
+                    self._insert_node(CH_ROOT, chId, chapterIds)
+                elif chId in elementIds:
+                    isChanged = True
+                    novel.chapters[chId].from_xml(elements[chId])
+
+                siblingIds = [section.id for section in chapter.sections]
+                for scId in sectionIds:
+                    if scId in novel.sections:
+                        section = novel.sections[scId]
+                        plotLines = section.scPlotLines
+                        plotPoints = section.scPlotPoints
+                    else:
+                        section = nvService.new_section(
+                            on_element_change=self._mdl.on_element_change,
+                        )
+                        plotLines = []
+                        plotPoints = {}
+                    isChanged = True
+                    section.from_xml(elements[scId])
+
+                    # Keep the plot line associations of the model,
+                    # and drop references to deleted elements.
+                    section.scPlotLines = plotLines
+                    section.scPlotPoints = plotPoints
+                    section.characters = [
+                        crId for crId in section.characters
+                        if crId in novel.characters
+                    ]
+                    section.locations = [
+                        lcId for lcId in section.locations
+                        if lcId in novel.locations
+                    ]
+                    section.items = [
+                        itId for itId in section.items
+                        if itId in novel.items
+                    ]
+                    if scId not in novel.sections:
+                        novel.sections[scId] = section
+                        self._insert_node(chId, scId, siblingIds)
+                    sectionCount += 1
+        finally:
+            # Partly merged changes must be saved, too.
+            if isChanged:
+                self._mdl.isModified = True
+        return sectionCount
+
     def _open_folder(self, event=None):
         # Open the snapshot folder with the OS file manager.
         snapshotDir = self._get_snapshot_dir()
@@ -395,59 +831,143 @@ class SnapshotService(SubController):
     def _open_help(self, event=None):
         Nvsnapshotshelp.open_help_page()
 
-    def _remove_snapshot(self, event=None):
+    def _prune_snapshots(self, event=None):
+        # Show the snapshots that the retention policy does not keep,
+        # and delete them on confirmation.
         self._ui.restore_status()
-        snapshotId = self.snapshotView.get_selection()
-        if snapshotId is None:
+        if self._writer.is_busy():
+            self._ui.set_status(f'#{_("Snapshot in progress")}.')
             return
 
-        try:
-            if self._ui.ask_yes_no(
-                message=_('Delete the selected snapshot?'),
-                detail=self.prjSnapshots[snapshotId].get('title', ''),
-                title=FEATURE,
-                parent=self.snapshotView,
-            ):
-                os.remove(self._get_zipfile_path(snapshotId))
-                self.refresh()
-        except ValueError as ex:
-            self._ui.set_status(
-                f'!{_("Can not remove snapshot")}: '
-                f'{str(ex)}'
+        obsoleteIds = self._get_obsolete_snapshots()
+        if not obsoleteIds:
+            self._ui.set_status(f'#{_("No snapshots to delete")}.')
+            return
+
+        reclaimed = self._get_catalog().get_reclaimable_size(obsoleteIds)
+        detail = obsoleteIds[:self.PREVIEW_LINES]
+        if len(obsoleteIds) > self.PREVIEW_LINES:
+            detail.append('...')
+        detail.append('')
+        detail.append(
+            f'{_("Snapshots")}: {len(obsoleteIds)}, '
+            f'{_("Space reclaimed")}: {reclaimed / 1024 / 1024:.1f} MiB'
+        )
+        if self._ui.ask_yes_no(
+            message=_('Delete these snapshots?'),
+            detail='\n'.join(detail),
+            title=FEATURE,
+            parent=self.snapshotView,
+        ):
+            self._delete_snapshots(obsoleteIds)
+
+    def _read_snapshot(self, snapshotId):
+        # Return a novx file object with the snapshot's parsed novel.
+        # Recently parsed novels are cached, so repeated exports
+        # of the same snapshot do not read the archive again.
+        zipPath = self._get_zipfile_path(snapshotId)
+        cacheKey = (snapshotId, os.stat(zipPath).st_mtime_ns)
+        if cacheKey in self._novelCache:
+            self._novelCache.move_to_end(cacheKey)
+            return self._novelCache[cacheKey]
+
+        if self.prjSnapshots[snapshotId].get('storage', 'zip') == 'zip':
+            novxFile = self._mdl.nvService.new_zipped_novx_file(zipPath)
+            novxFile.novel = self._mdl.nvService.new_novel()
+            novxFile.read()
+        else:
+            # The project file is not stored as a whole,
+            # so it is temporarily rebuilt in the snapshot folder.
+            novxPath = os.path.join(
+                self._get_snapshot_dir(),
+                f'{snapshotId}{self._mdl.nvService.get_novx_file_extension()}'
             )
+            try:
+                SnapshotArchive(zipPath).extract_project(novxPath)
+                novxFile = self._mdl.nvService.new_novx_file(novxPath)
+                novxFile.novel = self._mdl.nvService.new_novel()
+                novxFile.read()
+            finally:
+                if os.path.isfile(novxPath):
+                    os.remove(novxPath)
+
+        self._novelCache[cacheKey] = novxFile
+        if len(self._novelCache) > self.NOVEL_CACHE_SIZE:
+            self._novelCache.popitem(last=False)
+        return novxFile
 
-    def _revert(self, event=None):
+    def _remove_snapshot(self, event=None):
+        # Delete the selected snapshots in the background,
+        # and update the view once at the end.
         self._ui.restore_status()
+        snapshotIds = self.snapshotView.get_selections()
+        if not snapshotIds:
+            return
 
-        if self._ctrl.check_lock():
+        if self._writer.is_busy():
+            self._ui.set_status(f'#{_("Snapshot in progress")}.')
             return
 
-        snapshotIdToRestore = self.snapshotView.get_selection()
-        if snapshotIdToRestore is None:
+        if len(snapshotIds) == 1:
+            message = _('Delete the selected snapshot?')
+        else:
+            message = _('Delete the selected snapshots?')
+
+        # A selected month stands for all its snapshots,
+        # even the ones not shown, so each snapshot is listed.
+        detail = []
+        for snapshotId in snapshotIds[:self.PREVIEW_LINES]:
+            metadata = self.prjSnapshots[snapshotId]
+            detail.append(
+                f'{metadata.get("date", snapshotId)} '
+                f'"{metadata.get("title", "")}"'
+            )
+        if len(snapshotIds) > self.PREVIEW_LINES:
+            detail.append('...')
+        if len(snapshotIds) > 1:
+            detail.append('')
+            detail.append(f'{_("Snapshots")}: {len(snapshotIds)}')
+        if not self._ui.ask_yes_no(
+            message=message,
+            detail='\n'.join(detail),
+            title=FEATURE,
+            parent=self.snapshotView,
+        ):
             return
 
-        #--- Check whether an up-to-date snapshot already exists.
-        self._initialize_snapshot()
-        if (
-            not os.path.isfile(self._zipPath)
-            or self._mdl.isModified
+        self._delete_snapshots(snapshotIds)
+
+    def _report_error(self, error):
+        # Show an error raised while processing a background job's result.
+        self._ui.set_status(f'!{str(error)}')
+
+    def _restore_snapshot(self, snapshotIdToRestore):
+        # Overwrite the project file with the snapshot's project file
+        # and reopen the project.
+        # The file is replaced only after the extracted copy
+        # has been verified.
+        # This may be called after the safety snapshot has been
+        # written in the background, so lock and changes are
+        # checked again.
+        if self._ctrl.check_lock():
+            return
+
+        if self._mdl.isModified and not self._ui.ask_yes_no(
+            message=_('The project has been changed meanwhile.'),
+            detail=_(
+                'The changes are not in the safety snapshot. '
+                'Discard them and revert anyway?'
+            ),
+            title=FEATURE,
         ):
-            if self._mdl.isModified:
-                self._ctrl.save_project()
-                self._initialize_snapshot()
-            self.snapshotTitle = _('Auto-generated snapshot')
-            self.snapshotComment = _('Before reverting to {} \n"{}"').format(
-                    snapshotIdToRestore,
-                    self.prjSnapshots[snapshotIdToRestore]['title']
-                )
-            self._save_snapshot()
+            self._ui.set_status(f'#{_("Action canceled by user")}.')
+            return
+
         zipFileToRestore = self._get_zipfile_path(snapshotIdToRestore)
         try:
-            with zipfile.ZipFile(zipFileToRestore, 'r') as z:
-                z.extract(
-                    self._prjFile,
-                    path=self._prjDir,
-                )
+            SnapshotArchive(zipFileToRestore).extract_project(
+                self._mdl.prjFile.filePath
+            )
             self._ctrl.open_project(
                 filePath=self._mdl.prjFile.filePath,
                 doNotSave=True,
@@ -465,56 +985,369 @@ class SnapshotService(SubController):
         finally:
             self._ui.set_status(message)
 
-    def _sanitize_filename(self, filename):
-        # Return filename with disallowed characters removed.
-        return re.sub(r'[\\|\/|\:|\*|\?|\"|\<|\>|\|]+', '', filename)
+    def _restore_parts(self, event=None):
+        # Let the user select chapters and sections of a snapshot,
+        # and merge them into the open project.
+        # The snapshot is streamed from the archive twice:
+        # once for the list, and once for the selected elements.
+        self._ui.restore_status()
 
-    def _save_snapshot(self, event=None):
-        #--- Collect project metadata.
-        wordCount, totalCount = self._mdl.prjFile.count_words()
-        snapshotMetadata = {
-            self._snapshotId: {
-                'title': self.snapshotTitle,
-                'description': self.snapshotComment,
-                'date': self._isoDate,
-                'work phase': self._mdl.novel.workPhase,
-                'words used': wordCount,
-                'words total':totalCount,
-            }
-        }
+        if self._ctrl.check_lock():
+            return
 
-        #--- Write the snapshot.
-        try:
-            with zipfile.ZipFile(self._zipPath, 'w') as z:
+        snapshotId = self._get_single_selection()
+        if snapshotId is None:
+            return
+
+        archive = SnapshotArchive(self._get_zipfile_path(snapshotId))
 
-                # Write project file.
-                z.write(
-                    self._mdl.prjFile.filePath,
-                    arcname=self._prjFile,
-                    compress_type=zipfile.ZIP_DEFLATED,
+        def restore(elementIds):
+            # Read the selected elements, and the chapters
+            # of the selected sections in case they are missing.
+            keepIds = set(elementIds)
+            for chapter in summary.chapters:
+                for section in chapter.sections:
+                    if section.id in elementIds:
+                        keepIds.add(chapter.id)
+                        break
+
+            try:
+                sectionCount = self._merge_elements(
+                    archive.scan_project(keepIds),
+                    elementIds,
                 )
+            except Exception as ex:
+                self._ui.set_status(
+                    f'!{_("Can not restore snapshot")}: {str(ex)}'
+                )
+            else:
+                self._ui.set_status(
+                    f'{_("Sections restored")}: {sectionCount} '
+                    f'({snapshotId})'
+                )
+
+        try:
+            summary = archive.scan_project()
+        except Exception as ex:
+            self._ui.set_status(f'!{str(ex)}')
+            return
+
+        PartialRestoreDialog(self._ui, summary, restore)
+
+    def _revert(self, event=None):
+        self._ui.restore_status()
+
+        if self._ctrl.check_lock():
+            return
+
+        snapshotIdToRestore = self._get_single_selection()
+        if snapshotIdToRestore is None:
+            return
+
+        if self._writer.is_busy():
+            self._ui.set_status(f'#{_("Snapshot in progress")}.')
+            return
+
+        if self._mdl.isModified:
+            self._ctrl.save_project()
+
+        #--- Check whether the project file already matches the snapshot.
+        if SnapshotArchive(
+            self._get_zipfile_path(snapshotIdToRestore)
+        ).matches(
+            self._mdl.prjFile.filePath,
+            self.prjSnapshots[snapshotIdToRestore],
+        ):
+            self._ui.set_status(
+                f'#{_("The project already matches the snapshot")}.'
+            )
+            return
 
-                # Write descriptive text file.
-                z.writestr(
-                    (
-                        f'{self._sanitize_filename(self.snapshotTitle)}'
-                        f'{self.DESC_EXTENSION}'
-                    ),
-                    f'{self.snapshotTitle}\n\n{self.snapshotComment}',
-                    compress_type=zipfile.ZIP_DEFLATED,
+        #--- Check whether an up-to-date snapshot already exists.
+        self._initialize_snapshot()
+        if (
+            not os.path.isfile(self._zipPath)
+            and self._find_identical_snapshot() is None
+        ):
+            self.snapshotTitle = _('Auto-generated snapshot')
+            self.snapshotComment = _('Before reverting to {} \n"{}"').format(
+                    snapshotIdToRestore,
+                    self.prjSnapshots[snapshotIdToRestore]['title']
                 )
 
-                # Write JSON metadata file.
-                z.writestr(
-                    'meta.json',
-                    json.dumps(snapshotMetadata),
-                    compress_type=zipfile.ZIP_DEFLATED,
+            # Restore after the auto-generated snapshot is written.
+            self._save_snapshot(
+                onSuccess=lambda: self._restore_snapshot(snapshotIdToRestore),
+                isAuto=True,
+            )
+            return
+
+        self._restore_snapshot(snapshotIdToRestore)
+
+    def _run_benchmark(self, event=None):
+        # Compress the project file with several settings
+        # in the background, and show throughput and ratio.
+        self._ui.restore_status()
+        if self._mdl.prjFile is None or self._mdl.prjFile.filePath is None:
+            return
+
+        if self._writer.is_busy():
+            self._ui.set_status(f'#{_("Snapshot in progress")}.')
+            return
+
+        prjPath = self._mdl.prjFile.filePath
+
+        def benchmark(progress):
+            return run_benchmark(prjPath, progress=progress)
+
+        def show_progress(done, total):
+            self._ui.set_status(f'{_("Benchmark")}: {done}/{total}')
+
+        def finish(results, error):
+            if self._mdl.prjFile is None:
+                # The project was closed meanwhile.
+                return
+
+            if error is not None:
+                self._ui.set_status(f'!{str(error)}')
+                return
+
+            self._ui.restore_status()
+            self._ui.show_info(
+                message=_('Compression benchmark'),
+                detail='\n'.join(format_benchmark(results)),
+                title=FEATURE,
+            )
+
+        self._writer.submit(
+            benchmark,
+            onProgress=show_progress,
+            onDone=finish,
+        )
+
+    def _save_snapshot(self, event=None, onSuccess=None, isAuto=False):
+        #--- Collect project metadata.
+        # Work phase and word counts are collected while archiving.
+        snapshotId = self._snapshotId
+        isoDate = self._isoDate
+        metadata = {
+            'title': self.snapshotTitle,
+            'description': self.snapshotComment,
+            'date': isoDate,
+        }
+        if isAuto:
+            metadata['auto'] = True
+        archive = SnapshotArchive(self._zipPath)
+        prjPath = self._mdl.prjFile.filePath
+        if prjPath.lower().endswith(SnapshotArchive.COMPRESSED_EXTENSIONS):
+            # The project file can not be scanned,
+            # so the words are counted in the model.
+            # The model is not thread-safe, so this is done
+            # in the main thread.
+            wordCount, totalCount = self._mdl.prjFile.count_words()
+            metadata['work phase'] = self._mdl.novel.workPhase
+            metadata['words used'] = wordCount
+            metadata['words total'] = totalCount
+            metadata['chapters'] = get_chapter_table(
+                self._get_chapter_summaries()
+            )
+        sectionContents = None
+        if self.prefs['auto_snapshot_on_save'] and not self._mdl.isModified:
+            sectionContents = self._get_section_contents()
+        storageMode = self.prefs['storage_mode']
+        if storageMode not in SnapshotArchive.STORAGE_MODES:
+            storageMode = 'zip'
+        basePath = None
+        if storageMode == 'delta':
+            basePath = self._get_delta_base()
+        if isAuto:
+            compression = self.prefs['compression_auto']
+        else:
+            compression = self.prefs['compression_manual']
+
+        #--- Write the snapshot in the background.
+        def write_snapshot(progress):
+            archive.write(
+                prjPath,
+                snapshotId,
+                metadata,
+                progress=progress,
+                storageMode=storageMode,
+                base=basePath,
+                compression=compression,
+            )
+
+        def show_progress(doneBytes, totalBytes):
+            if totalBytes:
+                self._ui.set_status(
+                    f'{_("Writing snapshot")}: '
+                    f'{100 * doneBytes // totalBytes}%'
                 )
 
-        except Exception as ex:
-            message = f'!{_("Snapshot failed")}: {str(ex)}'
+        def finish(result, error):
+            if self._mdl.prjFile is None:
+                # The project was closed meanwhile.
+                return
+
+            if error is not None:
+                message = f'!{_("Snapshot failed")}: {str(error)}'
+            else:
+                message = f'{_("Snapshot generated")} ({isoDate})'
+            self._ui.set_status(message)
+            self.refresh()
+            if error is not None:
+                return
+
+            if sectionContents is not None:
+                self._changeTracker.set_snapshot(sectionContents)
+            if onSuccess is not None:
+                onSuccess()
+            if self.prefs['auto_prune']:
+                # Thin out the snapshot folder without asking.
+                obsoleteIds = self._get_obsolete_snapshots()
+                if obsoleteIds:
+                    self._delete_snapshots(obsoleteIds)
+
+        self._writer.submit(
+            write_snapshot,
+            onProgress=show_progress,
+            onDone=finish,
+        )
+
+    def _show_export_report(self, snapshotId, results):
+        # Show the combined status messages of a batch export.
+        failures = [
+            result for result in results
+            if result and result.startswith('!')
+        ]
+        if failures:
+            self._ui.set_status(
+                f'!{_("Export failed")}: '
+                f'{len(failures)}/{len(results)}'
+            )
         else:
-            message = f'{_("Snapshot generated")} ({self._isoDate})'
-        self._ui.set_status(message)
-        self.refresh()
+            self._ui.set_status(
+                f'{_("Documents exported")}: {len(results)}'
+            )
+        report = [(result or '').lstrip('!#') for result in results]
+        self._ui.show_info(
+            message=f'{_("Export finished")}: "{snapshotId}"',
+            detail='\n'.join(report),
+            title=FEATURE,
+        )
+
+    def _verify_snapshots(self, event=None):
+        # Check the selected archives in worker processes,
+        # and show a report. Without selection, check all archives
+        # in the snapshot folder, skipping the archives verified before
+        # and not changed since.
+        self._ui.restore_status()
+        if self._mdl.prjFile is None:
+            return
+
+        if self._writer.is_busy():
+            self._ui.set_status(f'#{_("Snapshot in progress")}.')
+            return
+
+        selection = [
+            f'{snapshotId}{self.ZIP_EXTENSION}'
+            for snapshotId in self.snapshotView.get_selections()
+        ]
+        catalog = self._get_catalog()
+        if selection:
+            unverified = catalog.get_unverified(selection)
+        else:
+            unverified = catalog.get_unverified()
+        snapshotFiles = {
+            os.path.join(catalog.snapshotDir, snapshotFile): snapshotFile
+            for snapshotFile in unverified
+        }
+
+        def verify(progress):
+            # Worker processes would be started from the writer thread
+            # of the GUI, possibly in a frozen or embedded interpreter,
+            # so worker threads are used.
+            return verify_archives(
+                list(snapshotFiles),
+                progress=progress,
+                useThreads=True,
+            )
+
+        def show_progress(done, total):
+            self._ui.set_status(f'{_("Verifying snapshots")}: {done}/{total}')
+
+        def finish(results, error):
+            if self._mdl.prjFile is None:
+                # The project was closed meanwhile.
+                return
+
+            if error is not None:
+                self._ui.set_status(f'!{str(error)}')
+                return
+
+            catalog.set_verified(
+                unverified,
+                {
+                    snapshotFiles[filePath]: problems
+                    for filePath, problems in results.items()
+                },
+            )
+            problems = catalog.get_problems()
+            if selection:
+                problems = {
+                    snapshotFile: problems[snapshotFile]
+                    for snapshotFile in selection
+                    if snapshotFile in problems
+                }
+                total = len(unverified)
+            else:
+                total = len(catalog.entries)
+            if not problems:
+                self._ui.set_status(
+                    f'{_("Snapshots verified")}: {total} '
+                    f'({_("new")}: {len(results)})'
+                )
+                return
+
+            self._ui.set_status(
+                f'!{_("Damaged snapshots")}: '
+                f'{len(problems)}/{total}'
+            )
+            report = [
+                f'{snapshotFile}: {"; ".join(problems[snapshotFile])}'
+                for snapshotFile in problems
+            ]
+            self._ui.show_info(
+                message=_('Damaged snapshots'),
+                detail='\n'.join(report),
+                title=FEATURE,
+            )
+
+        self._writer.submit(
+            verify,
+            onProgress=show_progress,
+            onDone=finish,
+        )
+
+    def _take_scheduled_snapshot(self):
+        # Write an automatic snapshot of the saved project file.
+        # Return False, if the snapshot must be retried later.
+        if self._mdl.prjFile is None or self._mdl.prjFile.filePath is None:
+            return False
+
+        if self._mdl.isModified or self._writer.is_busy():
+            # Wait until the changes are saved.
+            return False
+
+        os.makedirs(self._get_snapshot_dir(), exist_ok=True)
+        self._initialize_snapshot()
+        if (
+            os.path.isfile(self._zipPath)
+            or self._find_identical_snapshot() is not None
+        ):
+            return True
 
+        self.snapshotTitle = _('Auto-generated snapshot')
+        self.snapshotComment = _('Scheduled snapshot')
+        self._save_snapshot(isAuto=True)
+        return True
@@ -0,0 +1,234 @@
+"""Provide a content-addressed object store for deduplicated snapshots.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+import hashlib
+import io
+import os
+import re
+import zlib
+
+CHUNK_BOUNDARY = re.compile(rb'<(?:CHAPTER|SECTION)[\s>]')
+READ_SIZE = 1024 * 1024
+
+
+def iter_novx_chunks(f):
+    """Split a novx file at chapter and section boundaries.
+
+    Positional arguments:
+        f -- Binary file object to read from.
+
+    Yield byte strings that join to the file content.
+    Each chunk but the first starts with a CHAPTER or SECTION start tag.
+    """
+    pending = b''
+    scanPos = 1
+    # Never split in front of the first byte.
+    while True:
+        data = f.read(READ_SIZE)
+        if not data:
+            break
+
+        pending += data
+        start = 0
+        for match in CHUNK_BOUNDARY.finditer(pending, scanPos):
+            yield pending[start:match.start()]
+            start = match.start()
+        pending = pending[start:]
+
+        # A start tag may be cut off at the end of the buffer.
+        scanPos = max(1, len(pending) - len(b'<SECTION '))
+    if pending:
+        yield pending
+
+
+class SnapshotStore:
+    """Store chunks of content once, addressed by their hash.
+
+    Objects are zlib compressed files named after the SHA-256 hash
+    of their uncompressed content, in subdirectories named after
+    the first two hex digits.
+    """
+    OBJECTS_DIR = 'objects'
+
+    def __init__(self, snapshotDir):
+        """Set the object store path.
+
+        Positional arguments:
+            snapshotDir: str -- Path to the snapshot folder.
+        """
+        self.storeDir = os.path.join(snapshotDir, self.OBJECTS_DIR)
+
+    def get(self, key):
+        """Return the uncompressed content of the object with the key."""
+        with open(self._get_object_path(key), 'rb') as f:
+            return zlib.decompress(f.read())
+
+    def get_size(self, keys):
+        """Return the total size of the stored objects in bytes.
+
+        Positional arguments:
+            keys -- Iterable of object keys.
+
+        Missing objects are not counted.
+        """
+        size = 0
+        for key in keys:
+            try:
+                size += os.path.getsize(self._get_object_path(key))
+            except OSError:
+                pass
+        return size
+
+    def iter_keys(self):
+        """Iterate over the keys of all stored objects."""
+        if not os.path.isdir(self.storeDir):
+            return
+
+        for subdir in os.listdir(self.storeDir):
+            subdirPath = os.path.join(self.storeDir, subdir)
+            if not os.path.isdir(subdirPath):
+                continue
+
+            for fileName in os.listdir(subdirPath):
+                if not fileName.endswith('.tmp'):
+                    yield f'{subdir}{fileName}'
+
+    def put(self, content):
+        """Store content, if not already stored, and return its key."""
+        key = hashlib.sha256(content).hexdigest()
+        objectPath = self._get_object_path(key)
+        if os.path.isfile(objectPath):
+            return key
+
+        os.makedirs(os.path.dirname(objectPath), exist_ok=True)
+        tempPath = f'{objectPath}.tmp'
+        with open(tempPath, 'wb') as f:
+            f.write(zlib.compress(content))
+        os.replace(tempPath, objectPath)
+        return key
+
+    def remove(self, keys):
+        """Delete the objects with the keys.
+
+        Positional arguments:
+            keys -- Iterable of object keys.
+
+        Return the number of bytes reclaimed.
+        """
+        reclaimed = 0
+        for key in keys:
+            objectPath = self._get_object_path(key)
+            try:
+                size = os.path.getsize(objectPath)
+                os.remove(objectPath)
+            except OSError:
+                pass
+            else:
+                reclaimed += size
+        return reclaimed
+
+    def remove_unreferenced(self, referencedKeys):
+        """Delete all objects whose keys are not referenced.
+
+        Positional arguments:
+            referencedKeys: set -- Keys of the objects to keep.
+
+        Return the number of bytes reclaimed.
+        """
+        return self.remove(
+            [key for key in self.iter_keys() if key not in referencedKeys]
+        )
+
+    def remove_temp_files(self):
+        """Delete the temporary files left by interrupted writes."""
+        if not os.path.isdir(self.storeDir):
+            return
+
+        for subdir in os.listdir(self.storeDir):
+            subdirPath = os.path.join(self.storeDir, subdir)
+            if not os.path.isdir(subdirPath):
+                continue
+
+            for fileName in os.listdir(subdirPath):
+                if fileName.endswith('.tmp'):
+                    try:
+                        os.remove(os.path.join(subdirPath, fileName))
+                    except OSError:
+                        pass
+
+    def _get_object_path(self, key):
+        return os.path.join(self.storeDir, key[:2], key[2:])
+
+
+class ChunkReader(io.RawIOBase):
+    """Read a sequence of byte strings like a binary file."""
+
+    @classmethod
+    def open(cls, chunks):
+        """Return a buffered binary file object reading the chunks.
+
+        Positional arguments:
+            chunks -- Iterable of byte strings.
+        """
+        return io.BufferedReader(cls(chunks))
+
+    def __init__(self, chunks):
+        super().__init__()
+        self._chunks = iter(chunks)
+        self._chunk = memoryview(b'')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self._pos >= len(self._chunk):
+            try:
+                self._chunk = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+
+            self._pos = 0
+        size = min(len(buffer), len(self._chunk) - self._pos)
+        buffer[:size] = self._chunk[self._pos:self._pos + size]
+        self._pos += size
+        return size
+
+
+class TeeReader:
+    """Pass the data read from a binary file on to consumers.
+
+    This way, a file can be compressed, hashed, and analyzed
+    in a single pass.
+    """
+
+    def __init__(self, f, consumers=(), progress=None, totalBytes=None):
+        """Set the file to read from.
+
+        Positional arguments:
+            f -- Binary file object.
+
+        Optional arguments:
+            consumers -- Objects with an update() method
+                         taking the data read.
+            progress -- Callback function taking the number of bytes
+                        read and the total number of bytes.
+            totalBytes: int -- Expected number of bytes.
+        """
+        self._f = f
+        self._consumers = consumers
+        self._progress = progress
+        self._totalBytes = totalBytes
+        self.bytesRead = 0
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        for consumer in self._consumers:
+            consumer.update(data)
+        self.bytesRead += len(data)
+        if data and self._progress is not None:
+            self._progress(self.bytesRead, self._totalBytes)
+        return data
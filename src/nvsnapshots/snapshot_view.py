@@ -18,7 +18,22 @@ import tkinter as tk
 
 
 class SnapshotView(tk.Toplevel):
+    """Snapshot manager window.
 
+    If there are more snapshots than the group_threshold setting,
+    they are grouped by month. Only the latest month's rows
+    are created up front; the other months' rows are created
+    when the month is expanded for the first time.
+
+    The rows can be sorted by clicking on the column headings,
+    and filtered by title, description, and work phase.
+    Typed sort keys are computed once per snapshot.
+    Descriptions are not part of the snapshot metadata; they are
+    requested from the service when needed.
+    """
+
+    _GROUP_PREFIX = 'month:'
+    _PLACEHOLDER_PREFIX = 'placeholder:'
     _COLUMNS = {
         'id':('ID', 'id_width'),
         'title':(_('Title'), 'title_width'),
@@ -27,13 +42,16 @@ class SnapshotView(tk.Toplevel):
         'words_total':(_('With unused'), 'words_total_width'),
         'work_phase':(_('Work phase'), 'work_phase_width'),
     }
+    _FILTER_DELAY = 200
+    # milliseconds
 
-    def __init__(self, model, view, controller, prefs):
+    def __init__(self, model, view, controller, prefs, service):
         super().__init__()
         self._mdl = model
         self._ui = view
         self._ctrl = controller
         self.prefs = prefs
+        self._service = service
         self.geometry(f"{self.prefs['window_geometry']}")
 
         self.title(FEATURE)
@@ -53,12 +71,35 @@ class SnapshotView(tk.Toplevel):
             expand=True,
         )
 
+        # Left frame for the filter bar and the tree.
+        leftFrame = ttk.Frame(self._mainWindow)
+        leftFrame.pack(
+            side='left',
+            expand=True,
+            fill='both',
+        )
+
+        # Filter bar.
+        filterBar = ttk.Frame(leftFrame)
+        filterBar.pack(side='top', fill='x')
+        ttk.Label(
+            filterBar,
+            text=_('Filter'),
+        ).pack(side='left', padx=2)
+        self._filterText = tk.StringVar()
+        self._filterText.trace_add('write', self._on_filter_change)
+        ttk.Entry(
+            filterBar,
+            textvariable=self._filterText,
+        ).pack(side='left', fill='x', expand=True, padx=2, pady=2)
+        self._filterJob = None
+
         # Tree for snapshot selection.
         self._treeView = ttk.Treeview(
-            self._mainWindow,
+            leftFrame,
             columns=tuple(self._COLUMNS),
             show='headings',
-            selectmode='browse',
+            selectmode='extended',
         )
         scrollY = ttk.Scrollbar(
             self._treeView,
@@ -73,6 +114,7 @@ class SnapshotView(tk.Toplevel):
             fill='both',
         )
         self._treeView.bind('<<TreeviewSelect>>', self._on_select_node)
+        self._treeView.bind('<<TreeviewOpen>>', self._on_open_node)
         for colId in self._COLUMNS:
             colText, colWidth = self._COLUMNS[colId]
             self._treeView.column(
@@ -83,6 +125,7 @@ class SnapshotView(tk.Toplevel):
                 colId,
                 text=colText,
                 anchor='w',
+                command=lambda c=colId: self._sort_by(c),
             )
 
         # "Index card" in the right frame.
@@ -106,53 +149,100 @@ class SnapshotView(tk.Toplevel):
 
         self.isOpen = True
         self.element = {}
+        self.snapshots = {}
+        self._rowCache = {}
+        # key: snapshot ID
+        # value: (metadata, column values, sort keys, search text)
+        self._rows = {}
+        # key: ID of a snapshot having a Tk item
+        # value: metadata shown in the Tk item
+        self._sortColumn = 'id'
+        self._sortDescending = False
+        self._isGrouped = False
+        self._loadedGroups = set()
+        self._groups = {}
+        # key: group node ID, value: list of snapshot IDs
 
     def get_selection(self):
-        try:
-            nodeId = self._treeView.selection()[0]
-        except IndexError:
+        """Return the ID of the selected snapshot.
+
+        Return None, unless exactly one snapshot row is selected.
+        """
+        selection = self._treeView.selection()
+        if len(selection) != 1:
             return None
-        else:
-            return nodeId
+
+        nodeId = selection[0]
+        if nodeId not in self.snapshots:
+            # Group node.
+            return None
+
+        return nodeId
+
+    def get_selections(self):
+        """Return a list with the IDs of all selected snapshots.
+
+        A selected group node stands for all snapshots of its month.
+        """
+        snapshotIds = {}
+        for nodeId in self._treeView.selection():
+            if nodeId in self._groups:
+                snapshotIds.update(dict.fromkeys(self._groups[nodeId]))
+            elif nodeId in self.snapshots:
+                snapshotIds[nodeId] = None
+        return list(snapshotIds)
 
     def reset_tree(self):
         for node in self._treeView.get_children(''):
             self._treeView.delete(node)
+        for snapshotId in self._rows:
+            if self._treeView.exists(snapshotId):
+                # Row hidden by the filter.
+                self._treeView.delete(snapshotId)
+        self._rows.clear()
+        self._rowCache.clear()
+        self._loadedGroups.clear()
+        self._groups.clear()
 
     def build_tree(self):
-        self.reset_tree()
-        for snapshotId in self.snapshots:
-            try:
-                displayDate = datetime.fromisoformat(
-                    self.snapshots[snapshotId]['date']
-                ).strftime('%c')
-                status = self.snapshots[snapshotId]['work phase']
-                if status is not None:
-                    workPhase = STATUS[status]
-                else:
-                    workPhase = _('Undefined')
-            except:
-                displayDate = self.snapshots[snapshotId]['date']
-            columns = [
-                snapshotId,
-                self.snapshots[snapshotId]['title'],
-                displayDate,
-                self.snapshots[snapshotId]['words used'],
-                self.snapshots[snapshotId]['words total'],
-                workPhase,
-            ]
-            self._treeView.insert(
-                '',
-                'end',
-                snapshotId,
-                values=columns,
-            )
-        self._indexCard.bodyBox.config(state='normal')
-        self._indexCard.bodyBox.clear()
-        self._indexCard.bodyBox.config(state='disabled')
-        self._indexCard.titleEntry.config(state='normal')
-        self._indexCard.title.set('')
-        self._indexCard.titleEntry.config(state='disabled')
+        """Update the rows to match the snapshots.
+
+        Only new, changed, and removed snapshots are processed,
+        so the selection and the scroll position are kept.
+        """
+        isGrouped = len(self.snapshots) > int(self.prefs['group_threshold'])
+        if isGrouped != self._isGrouped:
+            self.reset_tree()
+            self._isGrouped = isGrouped
+            if isGrouped:
+                self._treeView.configure(show='tree headings')
+            else:
+                self._treeView.configure(show='headings')
+
+        #--- Delete the rows of removed snapshots.
+        removedIds = [
+            snapshotId for snapshotId in self._rows
+            if snapshotId not in self.snapshots
+        ]
+        for snapshotId in removedIds:
+            if self._treeView.exists(snapshotId):
+                self._treeView.delete(snapshotId)
+            del self._rows[snapshotId]
+        for snapshotId in list(self._rowCache):
+            if snapshotId not in self.snapshots:
+                del self._rowCache[snapshotId]
+
+        #--- Show the filtered and sorted snapshots.
+        snapshotIds = self._get_visible_ids()
+        if isGrouped:
+            self._build_groups(snapshotIds)
+        else:
+            self._update_rows('', snapshotIds)
+
+        if self.get_selection() is None:
+            self._clear_element_view()
+        else:
+            self._on_select_node()
 
     def on_quit(self, event=None):
         self.update_idletasks()
@@ -163,13 +253,182 @@ class SnapshotView(tk.Toplevel):
         self.destroy()
         self.isOpen = False
 
-    def _on_select_node(self, event=None):
+    def _build_groups(self, snapshotIds):
+        # Create a node per month, and rows for the expanded months.
+        months = {}
+        for snapshotId in snapshotIds:
+            month = str(self.snapshots[snapshotId].get('date', ''))[:7]
+            months.setdefault(month, []).append(snapshotId)
+        groups = {}
+        isDescending = (
+            self._sortDescending
+            and self._sortColumn in ('id', 'date')
+        )
+        for month in sorted(months, reverse=isDescending):
+            groups[f'{self._GROUP_PREFIX}{month}'] = months[month]
+        self._groups = groups
+
+        removedGroups = [
+            groupId for groupId in self._treeView.get_children('')
+            if groupId not in groups
+        ]
+        for groupId in removedGroups:
+            # The group's rows are deleted along with the group node.
+            for snapshotId in self._treeView.get_children(groupId):
+                self._rows.pop(snapshotId, None)
+            self._treeView.delete(groupId)
+            self._loadedGroups.discard(groupId)
+
+        latestGroup = max(groups, default=None)
+        for groupId in groups:
+            text = (
+                f'{self._get_group_title(groupId)} '
+                f'({len(groups[groupId])})'
+            )
+            if self._treeView.exists(groupId):
+                self._treeView.item(groupId, text=text)
+            else:
+                self._treeView.insert('', 'end', groupId, text=text)
+                if groupId == latestGroup:
+                    self._treeView.item(groupId, open=True)
+                else:
+                    self._treeView.insert(
+                        groupId,
+                        'end',
+                        f'{self._PLACEHOLDER_PREFIX}{groupId}',
+                    )
+                    continue
+
+            if groupId == latestGroup or groupId in self._loadedGroups:
+                self._load_group(groupId)
+        if tuple(groups) != self._treeView.get_children(''):
+            self._treeView.set_children('', *groups)
+
+    def _clear_element_view(self):
+        self._indexCard.bodyBox.config(state='normal')
+        self._indexCard.bodyBox.clear()
+        self._indexCard.bodyBox.config(state='disabled')
+        self._indexCard.titleEntry.config(state='normal')
+        self._indexCard.title.set('')
+        self._indexCard.titleEntry.config(state='disabled')
+
+    def _get_group_title(self, groupId):
+        # Return the localized month of a group node.
+        month = groupId[len(self._GROUP_PREFIX):]
         try:
-            self.nodeId = self._treeView.selection()[0]
-        except IndexError:
+            return datetime.strptime(month, '%Y-%m').strftime('%B %Y')
+        except ValueError:
+            return _('Undefined')
+
+    def _get_row(self, snapshotId):
+        # Return the column values, the sort keys, and the search text
+        # of a snapshot.
+        # The values are cached along with the metadata
+        # they are made from.
+        metadata = self.snapshots[snapshotId]
+        cached = self._rowCache.get(snapshotId, None)
+        if cached is not None and cached[0] is metadata:
+            return cached
+
+        try:
+            date = datetime.fromisoformat(metadata['date'])
+            displayDate = date.strftime('%c')
+        except:
+            date = datetime.min
+            displayDate = metadata.get('date', '')
+        status = metadata.get('work phase', None)
+        if status is not None:
+            workPhase = STATUS[status]
+            phaseKey = int(status)
+        else:
+            workPhase = _('Undefined')
+            phaseKey = -1
+        title = metadata.get('title', '')
+        columns = [
+            snapshotId,
+            title,
+            displayDate,
+            metadata.get('words used', ''),
+            metadata.get('words total', ''),
+            workPhase,
+        ]
+        sortKeys = (
+            snapshotId,
+            str(title).casefold(),
+            date,
+            self._get_int(metadata.get('words used', None)),
+            self._get_int(metadata.get('words total', None)),
+            phaseKey,
+        )
+        searchText = f'{title}\n{workPhase}'.casefold()
+        row = (metadata, columns, sortKeys, searchText)
+        self._rowCache[snapshotId] = row
+        return row
+
+    def _get_int(self, value):
+        # Return value as sort key for integer columns.
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return -1
+
+    def _get_visible_ids(self):
+        # Return the IDs of the snapshots matching the filter,
+        # in sort order.
+        filterText = self._filterText.get().strip().casefold()
+        if filterText:
+            # Descriptions are loaded only when filtering.
+            descriptions = self._service.get_descriptions()
+            snapshotIds = [
+                snapshotId for snapshotId in self.snapshots
+                if filterText in self._get_row(snapshotId)[3]
+                or filterText in str(
+                    descriptions.get(snapshotId, '')
+                ).casefold()
+            ]
+        else:
+            self._service.release_descriptions()
+            snapshotIds = list(self.snapshots)
+        keyIndex = list(self._COLUMNS).index(self._sortColumn)
+        snapshotIds.sort(
+            key=lambda snapshotId: self._get_row(snapshotId)[2][keyIndex],
+            reverse=self._sortDescending,
+        )
+        return snapshotIds
+
+    def _load_group(self, groupId):
+        # Create the rows of a month's snapshots.
+        placeholder = f'{self._PLACEHOLDER_PREFIX}{groupId}'
+        if self._treeView.exists(placeholder):
+            self._treeView.delete(placeholder)
+        self._loadedGroups.add(groupId)
+        self._update_rows(groupId, self._groups[groupId])
+
+    def _on_filter_change(self, *args):
+        # Rebuild the tree after the user stopped typing.
+        if self._filterJob is not None:
+            self.after_cancel(self._filterJob)
+        self._filterJob = self.after(self._FILTER_DELAY, self._apply_filter)
+
+    def _apply_filter(self):
+        self._filterJob = None
+        self.build_tree()
+
+    def _on_open_node(self, event=None):
+        nodeId = self._treeView.focus()
+        if nodeId in self._groups and nodeId not in self._loadedGroups:
+            self._load_group(nodeId)
+
+    def _on_select_node(self, event=None):
+        self.nodeId = self.get_selection()
+        if self.nodeId is None:
+            self._clear_element_view()
             return
 
-        self.element = self.snapshots[self.nodeId]
+        self.element = self.snapshots[self.nodeId].copy()
+        self.element['description'] = self._service.get_description(
+            self.nodeId
+        )
         self._set_element_view()
 
     def _set_element_view(self, event=None):
@@ -182,3 +441,39 @@ class SnapshotView(tk.Toplevel):
         self._indexCard.title.set(self.element.get('title', ''))
         self._indexCard.titleEntry.config(state='disabled')
 
+    def _sort_by(self, colId):
+        # Sort the rows by a column; toggle the order on repeated clicks.
+        if colId == self._sortColumn:
+            self._sortDescending = not self._sortDescending
+        else:
+            self._sortColumn = colId
+            self._sortDescending = False
+        for column in self._COLUMNS:
+            text = self._COLUMNS[column][0]
+            if column == colId:
+                text = f'{text} {"▼" if self._sortDescending else "▲"}'
+            self._treeView.heading(column, text=text)
+        self.build_tree()
+
+    def _update_rows(self, parent, snapshotIds):
+        # Make the parent's rows match the snapshot IDs.
+        # Rows that are not listed are detached, but kept for reuse.
+        for snapshotId in snapshotIds:
+            metadata = self.snapshots[snapshotId]
+            shownMetadata = self._rows.get(snapshotId, None)
+            if shownMetadata is None:
+                self._treeView.insert(
+                    parent,
+                    'end',
+                    snapshotId,
+                    values=self._get_row(snapshotId)[1],
+                )
+                self._rows[snapshotId] = metadata
+            elif shownMetadata is not metadata:
+                self._treeView.item(
+                    snapshotId,
+                    values=self._get_row(snapshotId)[1],
+                )
+                self._rows[snapshotId] = metadata
+        if tuple(snapshotIds) != self._treeView.get_children(parent):
+            self._treeView.set_children(parent, *snapshotIds)
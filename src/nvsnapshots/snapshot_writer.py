@@ -0,0 +1,107 @@
+"""Provide a class for running snapshot jobs in the background.
+
+Copyright (c) Peter Triesberger
+For further information see https://github.com/peter88213/nv_snapshots
+License: GNU GPLv3 (https://www.gnu.org/licenses/gpl-3.0.en.html)
+"""
+import queue
+import threading
+
+
+class SnapshotWriter:
+    """Run snapshot jobs one after another in a worker thread.
+
+    Jobs must not access the GUI or the novelibre model.
+    Progress and results are handed back to the Tk main loop
+    by polling with after(), so all callbacks run in the main thread.
+    """
+    POLL_INTERVAL = 100
+    # milliseconds
+
+    def __init__(self, root, onError=None):
+        """Set the Tk widget used for polling.
+
+        Positional arguments:
+            root -- Tk widget providing the after() method.
+
+        Optional arguments:
+            onError -- Callable receiving the exception
+                       raised by a progress or done callback.
+        """
+        self._root = root
+        self._onError = onError
+        self._jobs = queue.Queue()
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._isPolling = False
+
+    def is_busy(self):
+        """Return True if jobs are pending or running."""
+        with self._lock:
+            return self._thread is not None
+
+    def submit(self, job, onProgress=None, onDone=None):
+        """Queue a job for the worker thread.
+
+        Positional arguments:
+            job -- Callable taking a progress callback as argument.
+
+        Optional arguments:
+            onProgress -- Callable receiving the job's progress arguments.
+            onDone -- Callable receiving the job's return value
+                      and the exception raised, if any.
+        """
+        with self._lock:
+            self._jobs.put((job, onProgress, onDone))
+            if self._thread is None:
+                # Non-daemon thread: A running job is completed
+                # even if the application is closed.
+                self._thread = threading.Thread(target=self._work)
+                self._thread.start()
+        if not self._isPolling:
+            self._isPolling = True
+            self._root.after(self.POLL_INTERVAL, self._poll)
+
+    def _poll(self):
+        # Process the worker thread's events in the main thread.
+        while True:
+            try:
+                callback, args = self._events.get_nowait()
+            except queue.Empty:
+                break
+
+            if callback is None:
+                continue
+
+            try:
+                callback(*args)
+            except Exception as ex:
+                # A failing callback must not stop the polling,
+                # otherwise no later job's callbacks would run.
+                if self._onError is not None:
+                    self._onError(ex)
+        if self.is_busy() or not self._events.empty():
+            self._root.after(self.POLL_INTERVAL, self._poll)
+        else:
+            self._isPolling = False
+
+    def _work(self):
+        # Worker thread: Process the job queue until it is empty.
+        while True:
+            with self._lock:
+                try:
+                    job, onProgress, onDone = self._jobs.get_nowait()
+                except queue.Empty:
+                    self._thread = None
+                    return
+
+            def progress(*args):
+                self._events.put((onProgress, args))
+
+            try:
+                result = job(progress)
+            except Exception as ex:
+                self._events.put((onDone, (None, ex)))
+            else:
+                self._events.put((onDone, (result, None)))